@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+# tools builds its OpenAI client at import; the benchmark runs offline unless told otherwise
+os.environ.setdefault("PHIZZY_MOCK_LLM", "1")
+
+import tools
+from body_store import DEFAULT_USER_ID, body_store
+from mock_llm import MockOpenAI
+from router import model_router
+
+# Messages each simulated session sends in turn
+BENCH_PROMPTS = [
+    "My right calf has been really tight since my run yesterday",
+    "I also feel a sharp pain in my lower back when I bend over",
+    "Which stretches can I do for my shoulders at my desk?",
+    "The calf pain is a bit better today, maybe a 4 out of 10",
+    "Should I be worried about the back pain?",
+    "Show me hamstring stretches",
+    "Thanks, that helps!",
+]
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+def _load_body_json() -> Optional[str]:
+    """The default user's body state from the live backend, serialized as the app sends it"""
+    snapshot = body_store.snapshot(DEFAULT_USER_ID)
+    return snapshot.prompt_json if snapshot.data else None
+
+async def _run_session(
+    session_id: int,
+    messages: int,
+    stream: bool,
+    body_json: Optional[str],
+    latencies: List[float],
+    ttfts: List[float],
+) -> None:
+    """One simulated user sending messages back to back, keeping their own history"""
+    chat_history: List[Dict[str, str]] = []
+    for i in range(messages):
+        prompt = BENCH_PROMPTS[(session_id + i) % len(BENCH_PROMPTS)]
+        start = time.perf_counter()
+        if stream:
+            analysis = tools.ChatAnalysisStream(prompt, chat_history=chat_history, body_json=body_json, use_cache=False)
+            async for _ in analysis:
+                pass
+            result = analysis.result
+            if analysis.ttft_ms is not None:
+                ttfts.append(analysis.ttft_ms)
+        else:
+            result = await tools.generate_chat_analysis(prompt, chat_history=chat_history, body_json=body_json, use_cache=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+        reply = result[0] if isinstance(result, tuple) else result
+        chat_history += [{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}]
+
+async def run_benchmark(
+    sessions: int = 10,
+    messages: int = 5,
+    stream: bool = True,
+    json_mode: bool = True,
+    client: Optional[Any] = None,
+) -> Dict[str, Any]:
+    """
+    Drive `sessions` concurrent simulated chats of `messages` turns each through the chat pipeline
+    against client (a MockOpenAI from the environment by default) and return latency statistics.
+    """
+    tools.client = client or MockOpenAI.from_env()
+    tool_messages: List[str] = []
+
+    async def count_message(message: str) -> None:
+        tool_messages.append(message)
+
+    tools.mcp_server.set_chat_callback(count_message)
+    body_json = _load_body_json() if json_mode else None
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    routes_before = dict(model_router.turns)
+    cache_before = dict(tools.prompt_cache_stats)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _run_session(session_id, messages, stream, body_json, latencies, ttfts)
+        for session_id in range(sessions)
+    ))
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "sessions": sessions,
+        "messages": len(latencies),
+        "elapsed_s": elapsed,
+        "messages_per_s": len(latencies) / elapsed,
+        "llm_calls_per_message": getattr(tools.client, "calls", 0) / max(len(latencies), 1),
+        "tool_messages": len(tool_messages),
+        "routes": {name: count - routes_before.get(name, 0) for name, count in model_router.turns.items()},
+        # Share of prompt tokens the provider served from its prompt cache
+        "cached_prompt_share": (
+            (tools.prompt_cache_stats["cached_tokens"] - cache_before["cached_tokens"])
+            / max(tools.prompt_cache_stats["prompt_tokens"] - cache_before["prompt_tokens"], 1)
+        ),
+    }
+    for name, values in (("latency_ms", latencies), ("ttft_ms", ttfts)):
+        for pct in (50, 95, 99):
+            report[f"{name}_p{pct}"] = percentile(values, pct)
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"{report['messages']} messages from {report['sessions']} sessions in {report['elapsed_s']:.2f}s: "
+        f"{report['messages_per_s']:.1f} messages/s, {report['llm_calls_per_message']:.2f} LLM calls/message, "
+        f"{report['tool_messages']} tool messages, routes {report['routes']}, "
+        f"{report['cached_prompt_share']:.0%} of prompt tokens cached"
+    )
+    for name in ("latency_ms", "ttft_ms"):
+        if not math.isnan(report[f"{name}_p50"]):
+            print(f"  {name}: p50 {report[f'{name}_p50']:.0f}  p95 {report[f'{name}_p95']:.0f}  p99 {report[f'{name}_p99']:.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark of the chat pipeline")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated sessions")
+    parser.add_argument("--messages", type=int, default=5, help="messages per session")
+    parser.add_argument("--no-stream", action="store_true", help="use generate_chat_analysis instead of ChatAnalysisStream")
+    parser.add_argument("--chat-mode", action="store_true", help="send no body state (chat mode with tool follow-ups)")
+    parser.add_argument("--first-token-ms", type=float, help="simulated time to first token")
+    parser.add_argument("--token-ms", type=float, help="simulated time per streamed chunk")
+    parser.add_argument("--recordings", help="JSON file of recorded replies for the mock client")
+    parser.add_argument("--verbose", action="store_true", help="log every turn's routing, token and timing details")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    mock = MockOpenAI.from_env()
+    if args.first_token_ms is not None:
+        mock.first_token_ms = args.first_token_ms
+    if args.token_ms is not None:
+        mock.token_ms = args.token_ms
+    if args.recordings:
+        with open(args.recordings) as f:
+            mock.recordings = json.load(f)
+
+    print_report(asyncio.run(run_benchmark(
+        sessions=args.sessions,
+        messages=args.messages,
+        stream=not args.no_stream,
+        json_mode=not args.chat_mode,
+        client=mock,
+    )))
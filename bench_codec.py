@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Tuple, get_args
+
+from body_store import BODY_JSON_PATH
+from framing import CODECS, Codec, frame
+from mcp import MCPServer, MuscleType
+
+def _stretch_message() -> str:
+    """The chat card send_stretches produces for calves"""
+    messages: List[str] = []
+
+    async def capture(message: str) -> None:
+        messages.append(message)
+
+    server = MCPServer()
+    server.set_chat_callback(capture)
+    asyncio.run(server.send_stretches("calves"))
+    return messages[0]
+
+def _body_state() -> Dict[str, Any]:
+    if not os.path.exists(BODY_JSON_PATH):
+        return {}
+    with open(BODY_JSON_PATH) as f:
+        return json.load(f)
+
+def bench_messages() -> Dict[str, Any]:
+    """Representative MCP traffic, from small requests to whole-state replies"""
+    muscles = {muscle: "orange" for muscle in dict.fromkeys(get_args(MuscleType))}
+    return {
+        "update_status request": {"type": "tool", "action": "update_status", "params": {"muscles": {"calves": "red"}}, "id": 1},
+        "fetch_parts reply": {"status": "success", "data": {"version": 42, "changed": True, "muscles": muscles}, "id": 2},
+        "chat_message event": {"event": "chat_message", "data": {"muscle": "calves", "message": _stretch_message()}},
+        "body state reply": {"status": "success", "data": _body_state(), "id": 3},
+        "batch of 100 requests": [
+            {"type": "resource", "action": "fetch_parts", "params": {"since_version": 41}, "id": i} for i in range(100)
+        ],
+    }
+
+def _time(fn: Callable[[], Any], iterations: int) -> float:
+    """Microseconds per call"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def measure(codec: Codec, message: Any, line: bool, iterations: int) -> Tuple[int, float, float]:
+    """Bytes on the wire, encode and decode time of one message"""
+    if line:
+        encode = lambda: codec.encode(message) + b"\n"
+        decode = lambda: codec.decode(wire.rstrip(b"\n"))
+    else:
+        encode = lambda: frame(codec.encode(message))
+        decode = lambda: codec.decode(wire[4:])
+    wire = encode()
+    assert decode() == message
+    return len(wire), _time(encode, iterations), _time(decode, iterations)
+
+def run_benchmark(iterations: int) -> None:
+    # Line-JSON is the default wire format and the baseline
+    formats = [("json, line", CODECS["json"], True)] + [(f"{name}, framed", codec, False) for name, codec in CODECS.items()]
+    missing = [name for name in ("msgpack", "cbor") if name not in CODECS]
+    if missing:
+        print(f"Not installed, skipped: {', '.join(missing)}")
+    for label, message in bench_messages().items():
+        print(label)
+        baseline = None
+        for name, codec, line in formats:
+            size, encode_us, decode_us = measure(codec, message, line, iterations)
+            baseline = baseline or size
+            print(f"  {name:16} {size:8} bytes ({size / baseline:4.0%}) {encode_us:8.1f} us encode {decode_us:8.1f} us decode")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare MCP wire formats by size and encode/decode time")
+    parser.add_argument("--iterations", type=int, default=2000, help="encodes and decodes timed per message and format")
+    args = parser.parse_args()
+    run_benchmark(args.iterations)
@@ -0,0 +1,112 @@
+import argparse
+import random
+import time
+from io import BytesIO
+from typing import Any, Dict, List
+
+import numpy as np
+from PIL import Image
+
+from body_diagram import (
+    DEFAULT_DISPLAY_SIZE, DEFAULT_PAIN_COLOR, MUSCLE_GROUPS, PAINLEVEL_TO_COLOR, compose_body_image,
+    get_base_image, get_label_map, get_mask_image, get_overlay_renderer, size_bucket,
+)
+
+def random_body_states(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Body states with random pain levels, each differing from the previous one"""
+    rng = random.Random(seed)
+    levels = [level for level in PAINLEVEL_TO_COLOR if level]
+    return [
+        {muscle_name: {"pain_level": rng.choice(levels)} for muscle_name in MUSCLE_GROUPS.values()}
+        for _ in range(count)
+    ]
+
+def widget_encode(image) -> int:
+    """Bytes streamlit_image_coordinates sends when it encodes a PIL image itself (PNG, compress_level 0)"""
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", compress_level=0)
+    return len(buffered.getvalue())
+
+def legacy_compose(base_image, mask, body_data):
+    """The per-muscle pixel loop render_body_diagram used before the label map, as the reference output"""
+    image = base_image.copy()
+    image_pixels = image.load()
+    mask_pixels = mask.load()
+    width, height = image.size
+    for hex_color, muscle_name in MUSCLE_GROUPS.items():
+        if muscle_name in body_data:
+            pl = str(body_data[muscle_name].get('pain_level', ''))
+            color = PAINLEVEL_TO_COLOR.get(pl, DEFAULT_PAIN_COLOR)
+            # Find all pixels in mask matching this muscle's color
+            rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+            for i in range(width):
+                for j in range(height):
+                    if mask_pixels[i, j] == rgb:
+                        image_pixels[i, j] = color
+    return image
+
+def compare_legacy(renders: int, display_size) -> None:
+    """Time the legacy pixel loop against compose_body_image and check both produce the same pixels"""
+    render_size = size_bucket(display_size)
+    base = get_base_image(render_size)
+    labels = get_label_map(render_size)
+    base_image = Image.fromarray(base, "RGBA")
+    # The label map samples the native mask at pixel centres, which is what a nearest-neighbour resize does
+    mask = get_mask_image(None).resize(render_size, Image.NEAREST)
+    # No muscles present, then random pain levels for every muscle
+    states = [{}] + random_body_states(renders)
+    rows = {"legacy pixel loop": [], "compose_body_image": []}
+
+    for body_data in states:
+        start = time.perf_counter()
+        expected = np.asarray(legacy_compose(base_image, mask, body_data))
+        rows["legacy pixel loop"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        composed = np.asarray(compose_body_image(base, labels, body_data))
+        rows["compose_body_image"].append((time.perf_counter() - start) * 1000)
+        differing = int(np.any(expected != composed, axis=-1).sum())
+        assert differing == 0, f"compose_body_image differs from the legacy loop in {differing} pixels"
+
+    print(f"{len(states)} body states at {render_size[0]}x{render_size[1]}, pixel-for-pixel equal (ms to recolour)")
+    for name, times in rows.items():
+        times = sorted(times)
+        print(f"  {name:24} {times[len(times) // 2]:10.2f} ms median {times[-1]:10.2f} ms max")
+
+def run_benchmark(renders: int, display_size) -> None:
+    render_size = size_bucket(display_size)
+    renderer = get_overlay_renderer(render_size)
+    states = random_body_states(renders)
+    rows = {"widget default": [], "png, changed": [], "png, unchanged rerun": []}
+
+    for body_data in states:
+        image = renderer.render(body_data)
+        start = time.perf_counter()
+        size = widget_encode(image)
+        rows["widget default"].append((size, (time.perf_counter() - start) * 1000))
+
+        # A state the encoded-bytes cache has not seen, then the same state again
+        for name in ("png, changed", "png, unchanged rerun"):
+            start = time.perf_counter()
+            encoded = renderer.render_encoded(body_data)
+            rows[name].append((len(encoded.data), (time.perf_counter() - start) * 1000))
+
+    print(f"{renders} renders at {render_size[0]}x{render_size[1]} (bytes sent and ms to encode per render)")
+    for name, results in rows.items():
+        sizes = sorted(size for size, _ in results)
+        times = sorted(ms for _, ms in results)
+        print(f"  {name:24} {sizes[len(sizes) // 2]:10,} B {times[len(times) // 2]:8.2f} ms median {times[-1]:8.2f} ms max")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bytes sent and encode time of the body diagram per render")
+    parser.add_argument("--renders", type=int, default=20, help="distinct body states rendered")
+    parser.add_argument("--width", type=int, default=DEFAULT_DISPLAY_SIZE[0])
+    parser.add_argument("--height", type=int, default=DEFAULT_DISPLAY_SIZE[1])
+    parser.add_argument(
+        "--compare-legacy", action="store_true",
+        help="time the legacy pixel loop against compose_body_image (slow; use few renders) and assert equal output",
+    )
+    args = parser.parse_args()
+    if args.compare_legacy:
+        compare_legacy(args.renders, (args.width, args.height))
+    else:
+        run_benchmark(args.renders, (args.width, args.height))
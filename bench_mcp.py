@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+from typing import Any, Dict, List, Set
+
+from mcp import MAX_FRAME_BYTES, MCPServer
+
+# Connection handlers still running, awaited between runs so each run starts from an idle server
+_handlers: Set[asyncio.Task] = set()
+
+async def _start(server: MCPServer) -> asyncio.AbstractServer:
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        _handlers.add(task)
+        try:
+            await server._handle_client(reader, writer)
+        finally:
+            _handlers.discard(task)
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0, limit=MAX_FRAME_BYTES)
+
+async def _close(writer: asyncio.StreamWriter) -> None:
+    writer.close()
+    await writer.wait_closed()
+    while _handlers:
+        await asyncio.wait(list(_handlers))
+
+def _request(action: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    request_type = "resource" if action == "fetch_parts" else "tool"
+    return {"type": request_type, "action": action, "params": params}
+
+async def run_sequential(port: int, requests: List[Dict[str, Any]]) -> float:
+    """One request per round trip, as a client of the original line protocol would; returns seconds"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=MAX_FRAME_BYTES)
+    start = time.perf_counter()
+    for request in requests:
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        await reader.readline()
+    elapsed = time.perf_counter() - start
+    await _close(writer)
+    return elapsed
+
+async def run_pipelined(port: int, requests: List[Dict[str, Any]], window: int) -> float:
+    """Up to window requests with ids in flight on one socket; returns seconds"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=MAX_FRAME_BYTES)
+    slots = asyncio.Semaphore(window)
+
+    async def send_all() -> None:
+        for request_id, request in enumerate(requests):
+            await slots.acquire()
+            writer.write(json.dumps({**request, "id": request_id}).encode() + b"\n")
+            await writer.drain()
+
+    start = time.perf_counter()
+    sender = asyncio.create_task(send_all())
+    for _ in requests:
+        json.loads(await reader.readline())
+        slots.release()
+    await sender
+    elapsed = time.perf_counter() - start
+    await _close(writer)
+    return elapsed
+
+async def run_batched(port: int, requests: List[Dict[str, Any]], batch_size: int) -> float:
+    """Requests sent as batch frames of batch_size, one round trip per frame; returns seconds"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=MAX_FRAME_BYTES)
+    start = time.perf_counter()
+    for offset in range(0, len(requests), batch_size):
+        batch = [{**request, "id": offset + i} for i, request in enumerate(requests[offset:offset + batch_size])]
+        writer.write(json.dumps(batch).encode() + b"\n")
+        await writer.drain()
+        json.loads(await reader.readline())
+    elapsed = time.perf_counter() - start
+    await _close(writer)
+    return elapsed
+
+async def run_benchmark(
+    count: int, action: str, params: Dict[str, Any], tool_ms: float, windows: List[int], batch_sizes: List[int]
+) -> None:
+    server = MCPServer()
+
+    async def slow_chat(message: str) -> None:
+        # Stands in for the I/O a real tool call waits on
+        await asyncio.sleep(tool_ms / 1000)
+
+    server.set_chat_callback(slow_chat)
+    listener = await _start(server)
+    port = listener.sockets[0].getsockname()[1]
+    requests = [_request(action, params) for _ in range(count)]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sequential = await run_sequential(port, requests)
+    latency = f" ({tool_ms:.0f}ms per call)" if action == "send_stretches" else ""
+    print(f"{action} x{count}{latency}, one socket")
+    print(f"  {'sequential':22} {count / sequential:8.0f} ops/s {sequential / count * 1e6:8.0f} us/op")
+    runs = [(f"pipelined, {window} in flight", run_pipelined, window) for window in windows]
+    runs += [(f"batches of {batch_size}", run_batched, batch_size) for batch_size in batch_sizes]
+    for name, run, size in runs:
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = await run(port, requests, size)
+        print(f"  {name:22} {count / elapsed:8.0f} ops/s {elapsed / count * 1e6:8.0f} us/op ({sequential / elapsed:.1f}x)")
+    listener.close()
+    await listener.wait_closed()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MCP server request handling over one connection")
+    parser.add_argument("--count", type=int, default=500, help="requests per run")
+    parser.add_argument("--action", default="send_stretches", help="resource or tool to call, e.g. fetch_parts or update_status")
+    parser.add_argument("--params", default='{"muscle": "calves"}', help="JSON params of each request")
+    parser.add_argument("--tool-ms", type=float, default=5.0, help="simulated latency of each send_stretches call")
+    parser.add_argument("--windows", default="1,8,32", help="comma-separated in-flight limits to try")
+    parser.add_argument("--batch-sizes", default="10,100", help="comma-separated batch frame sizes to try")
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(
+        args.count, args.action, json.loads(args.params), args.tool_ms,
+        [int(window) for window in args.windows.split(",") if window],
+        [int(batch_size) for batch_size in args.batch_sizes.split(",") if batch_size],
+    ))
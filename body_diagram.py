@@ -1,43 +1,352 @@
 import streamlit as st
 import streamlit_image_coordinates as ic
 import os
-import json
+import threading
+import time
+import hashlib
+from io import BytesIO
+from collections import OrderedDict
+import numpy as np
 from PIL import Image
+from body_store import body_store
+from user_session import session_user_id
+from muscle_groups import MUSCLE_GROUPS
 
-# Define a dictionary mapping HEX colors to muscle group names (from colors.txt)
-MUSCLE_GROUPS = {
-    'ffff00': 'right trap',
-    '00ff00': 'right shoulder',
-    'ff00ff': 'right chest',
-    '0000ff': 'right bicep',
-    'ff0000': 'right forearm',
-    '00fff8': 'right oblique',
-    '2b3d29': 'left trap',
-    'b7ace8': 'left shoulder',
-    '4b5849': 'left chest',
-    '8425d8': 'left bicep',
-    '907389': 'left forearm',
-    'bf93e6': 'left oblique',
-    '67ff00': 'abs',
-    'ff00aa': 'groin',
-    'ff7000': 'right thigh',
-    '816e92': 'left thigh',
-    '67a095': 'right calf',
-    'c3eca7': 'left calf',
+# Integer label for each muscle group; 0 is reserved for pixels outside every muscle
+MUSCLE_LABELS = {muscle_name: label for label, muscle_name in enumerate(MUSCLE_GROUPS.values(), start=1)}
+MUSCLE_NAMES = [None] + list(MUSCLE_GROUPS.values())
+
+DEFAULT_PAIN_COLOR = (128, 128, 128, 180)
+PAINLEVEL_TO_COLOR = {
+    '8': (255, 0, 0, 180),
+    '5': (255, 165, 0, 180),
+    '1': (128, 128, 128, 180),
+    '0': (128, 128, 128, 180),
+    '': (128, 128, 128, 180),
+    None: (128, 128, 128, 180)
 }
 
-def render_body_diagram():
-    image_path = os.path.join("media", "front.png")
-    mask_path = os.path.join("media", "frontmask.png")
-    display_width, display_height = 600, 900
+# Overlay colours the renderer paints, mapped back to the pain level each one stands for.
+# Only 8 (red) and 5 (orange) are recoverable: grey is painted for every other level, so it maps to None.
+OVERLAY_PAIN_LEVELS = {}
+for _level, _color in PAINLEVEL_TO_COLOR.items():
+    shared = _color in OVERLAY_PAIN_LEVELS or _color == DEFAULT_PAIN_COLOR
+    OVERLAY_PAIN_LEVELS[_color] = None if shared else _level
+
+# Max per-channel difference for a pixel to count as an overlay colour
+OVERLAY_COLOR_TOLERANCE = 24
+# Fraction of a muscle that must carry its dominant overlay colour to be reported
+MIN_PAIN_COVERAGE = 0.5
+# Images decoded and swept together when extracting pain points from a batch
+PAIN_POINT_BATCH_SIZE = 16
+
+IMAGE_PATH = os.path.join("media", "front.png")
+MASK_PATH = os.path.join("media", "frontmask.png")
+
+DEFAULT_DISPLAY_SIZE = (600, 900)
+# Requested display sizes are rounded up to a multiple of this before rendering
+SIZE_BUCKET_STEP = 50
+# Number of size buckets whose assets and renderers are kept in memory at once
+MAX_SIZE_BUCKETS = 6
+# Each size bucket holds a handful of assets (base image, label map, label pixels, ...)
+MAX_CACHED_ASSETS = 5 * (MAX_SIZE_BUCKETS + 1)
+
+# zlib level of the PNG sent to the browser; streamlit_image_coordinates labels the bytes as a
+# data:image/png URL, so the diagram is always PNG
+DIAGRAM_PNG_COMPRESS_LEVEL = 6
+# Number of distinct encoded diagrams kept, keyed by content hash
+MAX_ENCODED_IMAGES = 32
+
+# Process-wide LRU cache of decoded assets shared by every Streamlit session.
+# Maps (kind, path, size) -> (mtime, value); values are read-only so sessions can share them safely.
+_asset_cache = OrderedDict()
+_asset_lock = threading.Lock()
+
+def size_bucket(size):
+    """Snap a requested (width, height) to the render size it is served from"""
+    return tuple(max(SIZE_BUCKET_STEP, -(-int(d) // SIZE_BUCKET_STEP) * SIZE_BUCKET_STEP) for d in size)
+
+def _cached_asset(kind, path, size, loader):
+    """Return the cached asset for (kind, path, size), reloading it if the file changed on disk"""
+    mtime = os.path.getmtime(path)
+    key = (kind, path, size)
+    with _asset_lock:
+        entry = _asset_cache.get(key)
+        if entry is not None and entry[0] == mtime:
+            _asset_cache.move_to_end(key)
+            return entry[1]
+
+    value = loader()
+    with _asset_lock:
+        _asset_cache[key] = (mtime, value)
+        _asset_cache.move_to_end(key)
+        while len(_asset_cache) > MAX_CACHED_ASSETS:
+            _asset_cache.popitem(last=False)
+    return value
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+def _load_resized(path, mode, size):
+    image = Image.open(path).convert(mode)
+    return image if size is None else image.resize(size)
+
+def get_base_image(size):
+    """Decoded and resized front.png as a shared read-only RGBA array (size None keeps the native size)"""
+    return _cached_asset(
+        "base", IMAGE_PATH, size,
+        lambda: _read_only(np.array(_load_resized(IMAGE_PATH, "RGBA", size))),
+    )
+
+def get_mask_image(size):
+    """Decoded and resized frontmask.png as a shared RGB image (treat as read-only)"""
+    return _cached_asset(
+        "mask", MASK_PATH, size,
+        lambda: _load_resized(MASK_PATH, "RGB", size),
+    )
+
+def get_label_map(size):
+    """
+    Shared read-only label map for the mask at the given size (size None keeps the native size).
+    Sized maps are nearest-neighbour samples of the native label map, so region colours stay exact
+    instead of being blended by resampling the colour mask.
+    """
+    def load():
+        if size is None:
+            return _read_only(build_label_map(get_mask_image(None)))
+        native = get_label_map(None)
+        rows = ((np.arange(size[1]) + 0.5) * native.shape[0] / size[1]).astype(np.intp)
+        cols = ((np.arange(size[0]) + 0.5) * native.shape[1] / size[0]).astype(np.intp)
+        return _read_only(native[np.ix_(rows, cols)])
+    return _cached_asset("labels", MASK_PATH, size, load)
+
+def get_label_pixels(size):
+    """Shared per-label flat pixel indices, so a single muscle region can be repainted in isolation"""
+    def load():
+        flat = get_label_map(size).ravel()
+        order = np.argsort(flat, kind="stable")
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(flat, minlength=len(MUSCLE_LABELS) + 1))))
+        return [_read_only(order[bounds[label]:bounds[label + 1]]) for label in range(len(MUSCLE_LABELS) + 1)]
+    return _cached_asset("label_pixels", MASK_PATH, size, load)
+
+def build_label_map(mask):
+    """
+    Decode a muscle mask image into a uint8 label array of shape (height, width).
+    Pixels whose colour exactly matches a MUSCLE_GROUPS entry get that muscle's label,
+    every other pixel gets 0.
+    """
+    rgb = np.asarray(mask.convert("RGB"), dtype=np.uint32)
+    packed = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+    # Sorted colour keys let us map every pixel with a single searchsorted pass
+    keys = np.array([int(hex_color, 16) for hex_color in MUSCLE_GROUPS], dtype=np.uint32)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    idx = np.minimum(np.searchsorted(sorted_keys, packed), len(sorted_keys) - 1)
+    labels = np.where(sorted_keys[idx] == packed, order[idx] + 1, 0)
+    return labels.astype(np.uint8)
+
+def pain_color_vector(body_data):
+    """
+    Overlay colour of every label for the given body state, indexed by label.
+    Entries are RGBA tuples, or None for labels that keep the base image.
+    """
+    colors = [None] * (len(MUSCLE_LABELS) + 1)
+    for muscle_name, label in MUSCLE_LABELS.items():
+        if muscle_name in body_data:
+            pl = str(body_data[muscle_name].get('pain_level', ''))
+            colors[label] = PAINLEVEL_TO_COLOR.get(pl, DEFAULT_PAIN_COLOR)
+    return tuple(colors)
+
+def build_palette(body_data):
+    """
+    Build the RGBA palette for the current body state.
+    Returns (palette, painted) where palette[label] is the overlay colour and
+    painted[label] tells whether that label should be recoloured at all.
+    """
+    palette = np.zeros((len(MUSCLE_LABELS) + 1, 4), dtype=np.uint8)
+    painted = np.zeros(len(MUSCLE_LABELS) + 1, dtype=bool)
+    for label, color in enumerate(pain_color_vector(body_data)):
+        if color is not None:
+            palette[label] = color
+            painted[label] = True
+    return palette, painted
+
+def compose_body_image(base, labels, body_data):
+    """
+    Recolour every muscle present in body_data in one vectorized pass over the label map.
+    base is an RGBA array (or image) of the same size as labels; it is never modified.
+    """
+    palette, painted = build_palette(body_data)
+    base = np.asarray(base)
+    out = np.where(painted[labels][..., None], palette[labels], base)
+    return Image.fromarray(out, "RGBA")
+
+def _get_regions():
+    """Bounding box, centroid and area of every muscle in native mask coordinates"""
+    def load():
+        labels = get_label_map(None)
+        width = labels.shape[1]
+        regions = {}
+        for muscle_name, label in MUSCLE_LABELS.items():
+            idx = get_label_pixels(None)[label]
+            if len(idx) == 0:
+                continue
+            ys, xs = np.divmod(idx, width)
+            regions[muscle_name] = {
+                "bbox": (int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1),
+                "centroid": (float(xs.mean()), float(ys.mean())),
+                "area": int(len(idx)),
+            }
+        return regions
+    return _cached_asset("regions", MASK_PATH, None, load)
+
+def muscle_at(x, y, size):
+    """
+    Hit-test a click at (x, y) on a diagram displayed at size (width, height).
+    Returns the muscle group name, or None if the point is outside every muscle.
+    """
+    labels = get_label_map(None)
+    native_height, native_width = labels.shape
+    # Sample the clicked pixel's centre, as get_label_map does when it paints the displayed size
+    mx = int((x + 0.5) * native_width / size[0])
+    my = int((y + 0.5) * native_height / size[1])
+    if not (0 <= mx < native_width and 0 <= my < native_height):
+        return None
+    label = labels[my, mx]
+    return MUSCLE_NAMES[label] if label else None
+
+def muscle_regions(size):
+    """
+    Per-muscle placement info scaled to a diagram displayed at size (width, height):
+    {"bbox": (left, top, right, bottom), "centroid": (x, y), "area": native pixel count}
+    """
+    native_height, native_width = get_label_map(None).shape
+    sx, sy = size[0] / native_width, size[1] / native_height
+    scaled = {}
+    for muscle_name, region in _get_regions().items():
+        left, top, right, bottom = region["bbox"]
+        cx, cy = region["centroid"]
+        scaled[muscle_name] = {
+            "bbox": (left * sx, top * sy, right * sx, bottom * sy),
+            "centroid": (cx * sx, cy * sy),
+            "area": region["area"],
+        }
+    return scaled
 
-    # Load body part data from body.json
-    with open("body.json", "r") as f:
-        body_data = json.load(f)
+class OverlayRenderer:
+    """
+    Keeps the last composed diagram for one display size and repaints only the
+    muscle regions whose pain colour changed since the previous render.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._assets = None
+        self._colors = None
+        self._pixels = None
+        self._image = None
+        self._encoded = None
 
-    if 'highlighted_image' not in st.session_state:
-        st.session_state.highlighted_image = Image.open(image_path).convert("RGBA").resize((display_width, display_height))
-    mask = Image.open(mask_path).convert("RGB").resize((display_width, display_height))
+    def render(self, body_data):
+        """Return the highlighted image for body_data, reusing the previous one if nothing changed"""
+        colors = pain_color_vector(body_data)
+        base = get_base_image(self.size)
+        labels = get_label_map(self.size)
+
+        with self._lock:
+            if self._assets is None or self._assets[0] is not base or self._assets[1] is not labels:
+                # First render, or the assets were reloaded from disk: compose from scratch
+                self._pixels = np.array(compose_body_image(base, labels, body_data))
+                self._assets = (base, labels)
+            else:
+                changed = [label for label, color in enumerate(colors) if color != self._colors[label]]
+                if not changed:
+                    return self._image
+
+                flat_pixels = self._pixels.reshape(-1, 4)
+                flat_base = base.reshape(-1, 4)
+                label_pixels = get_label_pixels(self.size)
+                for label in changed:
+                    idx = label_pixels[label]
+                    flat_pixels[idx] = flat_base[idx] if colors[label] is None else colors[label]
+
+            self._colors = colors
+            # Hand out a copy so images already given to other sessions never change underneath them
+            self._image = Image.fromarray(self._pixels.copy(), "RGBA")
+            self._encoded = None
+            return self._image
+
+    def render_encoded(self, body_data):
+        """Like render, but returns the encoded diagram, hashing and encoding only when the image changed"""
+        image = self.render(body_data)
+        with self._lock:
+            if self._image is image and self._encoded is not None:
+                return self._encoded
+
+        encoded = encode_diagram(image)
+        with self._lock:
+            if self._image is image:
+                self._encoded = encoded
+        return encoded
+
+class EncodedImage:
+    """
+    PNG diagram bytes ready to send to the browser.
+    save() writes the bytes as-is, so widgets that call image.save(...) skip re-encoding.
+    """
+    def __init__(self, data, size, encode_ms):
+        self.data = data
+        self.size = size
+        self.encode_ms = encode_ms
+
+    def save(self, fp, format=None, **params):
+        fp.write(self.data)
+
+_encoded_cache = OrderedDict()
+_encoded_lock = threading.Lock()
+
+def encode_diagram(image):
+    """PNG-encode a diagram image, reusing the cached bytes of any earlier image with identical content"""
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16).hexdigest()
+    key = (digest, image.size)
+    with _encoded_lock:
+        if key in _encoded_cache:
+            _encoded_cache.move_to_end(key)
+            return _encoded_cache[key]
+
+    start = time.perf_counter()
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", compress_level=DIAGRAM_PNG_COMPRESS_LEVEL)
+    encoded = EncodedImage(buffered.getvalue(), image.size, (time.perf_counter() - start) * 1000)
+
+    with _encoded_lock:
+        _encoded_cache[key] = encoded
+        while len(_encoded_cache) > MAX_ENCODED_IMAGES:
+            _encoded_cache.popitem(last=False)
+    return encoded
+
+_renderers = OrderedDict()
+_renderers_lock = threading.Lock()
+
+def get_overlay_renderer(size):
+    """Process-wide incremental renderer for the given render size, least recently used evicted first"""
+    with _renderers_lock:
+        if size not in _renderers:
+            _renderers[size] = OverlayRenderer(size)
+            while len(_renderers) > MAX_SIZE_BUCKETS:
+                _renderers.popitem(last=False)
+        _renderers.move_to_end(size)
+        return _renderers[size]
+
+def render_body_diagram(display_size=DEFAULT_DISPLAY_SIZE):
+    """Render the interactive body diagram at display_size (width, height)"""
+    display_width, display_height = display_size
+    render_size = size_bucket(display_size)
+
+    # Load this user's body part data
+    body_data = body_store.read(session_user_id())
 
     # Add color selector for pain level
     color_option = st.radio(
@@ -51,53 +360,26 @@ def render_body_diagram():
         "Orange (Medium Pain)": ((255, 165, 0, 180), '5'),
         "Grey (No Pain)": ((128, 128, 128, 180), '1')
     }
-    painlevel_to_color = {
-        '8': (255, 0, 0, 180),
-        '5': (255, 165, 0, 180),
-        '1': (128, 128, 128, 180),
-        '0': (128, 128, 128, 180),
-        '': (128, 128, 128, 180),
-        None: (128, 128, 128, 180)
-    }
     highlight_color, pain_level = color_map[color_option]
 
-    # Pre-highlight muscles based on body.json pain_level
-    image_pixels = st.session_state.highlighted_image.load()
-    mask_pixels = mask.load()
-    for hex_color, muscle_name in MUSCLE_GROUPS.items():
-        if muscle_name in body_data:
-            pl = str(body_data[muscle_name].get('pain_level', ''))
-            color = painlevel_to_color.get(pl, (128, 128, 128, 180))
-            # Find all pixels in mask matching this muscle's color
-            rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-            for i in range(display_width):
-                for j in range(display_height):
-                    if mask_pixels[i, j] == rgb:
-                        image_pixels[i, j] = color
+    # Pre-highlight muscles based on body.json pain_level.
+    # Only regions whose pain level changed since the last render are repainted,
+    # and unchanged diagrams reuse their cached encoded bytes.
+    highlighted_image = get_overlay_renderer(render_size).render_encoded(body_data)
 
     st.write("Click on the body diagram below:")
     result = ic.streamlit_image_coordinates(
-        st.session_state.highlighted_image,
+        highlighted_image,
         key="body-diagram",
         width=display_width,
         height=display_height,
     )
 
     if result is not None:
-        st.session_state.highlighted_image = Image.open(image_path).convert("RGBA").resize((display_width, display_height))
         x, y = result['x'], result['y']
-        clicked_color = mask.getpixel((x, y))
-        image_pixels = st.session_state.highlighted_image.load()
-        mask_pixels = mask.load()
 
-        for i in range(display_width):
-            for j in range(display_height):
-                if mask_pixels[i, j] == clicked_color:
-                    pass  # Remove the logic that changes the clicked body part to red
-
-        # Find the body part name based on the clicked color
-        hex_color = '%02x%02x%02x' % clicked_color[:3]
-        body_part = MUSCLE_GROUPS.get(hex_color, "Unknown")
+        # Find the body part name from the precomputed label map
+        body_part = muscle_at(x, y, display_size) or "Unknown"
 
         if body_part in body_data and st.session_state.get("last_clicked") != (x, y):
             # Update the last clicked position
@@ -126,6 +408,75 @@ def render_body_diagram():
         else:
             st.write("No data available for this body part.")
 
-#function to return pain points from highleted image
-def get_pain_points_from_image():
-    pass
\ No newline at end of file
+def _load_rgba(image):
+    if isinstance(image, (str, os.PathLike)):
+        image = Image.open(image)
+    return image.convert("RGBA")
+
+def _region_color_counts(pixels, labels):
+    """
+    Count overlay-coloured pixels per (image, muscle label, overlay colour) in a single sweep.
+    pixels is (N, H, W, 4) uint8, labels is (H, W); returns an (N, labels, colours + 1) array
+    where colour index 0 counts pixels that match no overlay colour.
+    """
+    overlay = np.array(list(OVERLAY_PAIN_LEVELS), dtype=np.int16)
+    color_idx = np.zeros(pixels.shape[:3], dtype=np.intp)
+    signed = pixels.astype(np.int16)
+    for k, color in enumerate(overlay, start=1):
+        match = (np.abs(signed - color) <= OVERLAY_COLOR_TOLERANCE).all(axis=-1)
+        color_idx[match & (color_idx == 0)] = k
+
+    n_images = pixels.shape[0]
+    n_labels = len(MUSCLE_LABELS) + 1
+    n_colors = len(overlay) + 1
+    image_idx = np.arange(n_images, dtype=np.intp)[:, None, None]
+    joint = (image_idx * n_labels + labels) * n_colors + color_idx
+    counts = np.bincount(joint.ravel(), minlength=n_images * n_labels * n_colors)
+    return counts.reshape(n_images, n_labels, n_colors)
+
+def get_pain_points_from_image(images=os.path.join("media", "_temp_highlighted.png")):
+    """
+    Recover per-muscle pain levels from highlighted diagram image(s).
+    images is a path or PIL image, or a list of them for batch processing.
+    Returns {muscle_name: {"pain_level", "color", "coverage"}} for every muscle whose dominant
+    overlay colour covers at least MIN_PAIN_COVERAGE of it (a list of such dicts for a batch).
+    Grey muscles get pain_level None: grey stands for any level other than 8 or 5, so it must not be
+    written back over a stored level.
+    """
+    single = not isinstance(images, (list, tuple))
+    if single:
+        images = [images]
+
+    overlay_colors = list(OVERLAY_PAIN_LEVELS)
+    results = [None] * len(images)
+    for start in range(0, len(images), PAIN_POINT_BATCH_SIZE):
+        chunk = [(i, _load_rgba(images[i])) for i in range(start, min(start + PAIN_POINT_BATCH_SIZE, len(images)))]
+
+        # Images of the same size share one label map and are swept together
+        by_size = {}
+        for i, image in chunk:
+            by_size.setdefault(image.size, []).append((i, image))
+
+        for size, group in by_size.items():
+            pixels = np.stack([np.asarray(image) for _, image in group])
+            counts = _region_color_counts(pixels, get_label_map(size))
+            areas = counts.sum(axis=-1)
+            dominant = counts[..., 1:].argmax(axis=-1)
+
+            for n, (i, _) in enumerate(group):
+                pain_points = {}
+                for muscle_name, label in MUSCLE_LABELS.items():
+                    if areas[n, label] == 0:
+                        continue
+                    k = dominant[n, label]
+                    coverage = counts[n, label, k + 1] / areas[n, label]
+                    if coverage >= MIN_PAIN_COVERAGE:
+                        color = overlay_colors[k]
+                        pain_points[muscle_name] = {
+                            "pain_level": OVERLAY_PAIN_LEVELS[color],
+                            "color": color,
+                            "coverage": float(coverage),
+                        }
+                results[i] = pain_points
+
+    return results[0] if single else results
\ No newline at end of file
@@ -0,0 +1,550 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import cached_property
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+BODY_JSON_PATH = "body.json"
+BODY_DB_PATH = "body_state.db"
+# Directory holding the per-user JSON shards of users other than the default one
+BODY_SHARDS_DIR = "body_states"
+# The user whose state lives in the legacy body.json and who gets it on migration
+DEFAULT_USER_ID = "default"
+# Prefix of the throwaway ids given to browser sessions; their state expires (see expire_users)
+SESSION_USER_PREFIX = "session-"
+# Number of users whose parsed state CachedBodyStore keeps, least recently used evicted first
+MAX_CACHED_USERS = int(os.getenv("PHIZZY_BODY_CACHE_USERS", "256"))
+
+def _merge_updates(body_data: Dict[str, Any], updates: Dict[str, Any]) -> None:
+    for muscle_group, info in updates.items():
+        if isinstance(body_data.get(muscle_group), dict) and isinstance(info, dict):
+            # Update existing muscle group data
+            body_data[muscle_group].update(info)
+        else:
+            # Add new muscle group data
+            body_data[muscle_group] = info
+
+class BodyStore:
+    """
+    Transactional JSON-file backend for body state, one document per user.
+    Writers hold an advisory lock on a sidecar lock file for the whole read-modify-write,
+    and every write goes to a temp file that is atomically renamed over the original,
+    so readers never see a partially written document.
+    """
+    def __init__(self, path: str = BODY_JSON_PATH, shards_dir: str = BODY_SHARDS_DIR):
+        self.path = path
+        self.shards_dir = shards_dir
+        # Serialises transactions between threads of this process; the file lock covers other processes
+        self._thread_lock = threading.Lock()
+        self._migrated_shards = set()
+
+    def path_for(self, user_id: str = DEFAULT_USER_ID) -> str:
+        """File holding user_id's state; the default user keeps the legacy body.json"""
+        if user_id == DEFAULT_USER_ID:
+            return self.path
+        # A digest keeps distinct ids in distinct files, whatever characters they contain;
+        # session ids keep their prefix so their shards can be found for expiry
+        prefix = SESSION_USER_PREFIX if user_id.startswith(SESSION_USER_PREFIX) else ""
+        path = os.path.join(self.shards_dir, f"{prefix}{hashlib.sha256(user_id.encode()).hexdigest()}.json")
+        if user_id not in self._migrated_shards:
+            self._migrate_shard(user_id, path)
+            self._migrated_shards.add(user_id)
+        return path
+
+    def _migrate_shard(self, user_id: str, path: str) -> None:
+        """Rename a shard saved under the old sanitised-id name; only ids that needed no sanitising are unambiguous"""
+        if re.fullmatch(r"[A-Za-z0-9_.-]+", user_id) is None or user_id in (".", ".."):
+            return
+        legacy_path = os.path.join(self.shards_dir, f"{user_id}.json")
+        if os.path.exists(legacy_path) and not os.path.exists(path):
+            try:
+                os.replace(legacy_path, path)
+            except FileNotFoundError:
+                # Another process migrated it first
+                pass
+
+    @contextmanager
+    def _file_lock(self, path: str) -> Iterator[None]:
+        with open(path + ".lock", "a+") as lock_file:
+            if sys.platform == "win32":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if sys.platform == "win32":
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def document_path(self, key: str, user_id: str = DEFAULT_USER_ID) -> str:
+        """File holding one of user_id's side documents, which read() never returns"""
+        root, _ = os.path.splitext(self.path_for(user_id))
+        return f"{root}.{key}.json"
+
+    def _read_file(self, path: str, strict: bool = False) -> Dict[str, Any]:
+        """
+        A missing file is empty. So is a corrupt one, unless strict: writers must not replace a
+        document they could not read, so they get a ValueError instead.
+        """
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                if strict:
+                    raise ValueError(f"{path} is not valid JSON ({e}); fix or remove it") from e
+                return {}
+        if not isinstance(data, dict):
+            if strict:
+                raise ValueError(f"{path} does not hold a JSON object; fix or remove it")
+            return {}
+        return data
+
+    def read(self, user_id: str = DEFAULT_USER_ID, strict: bool = False) -> Dict[str, Any]:
+        """Read a user's body state; with strict, a corrupt file raises ValueError instead of reading as empty"""
+        return self._read_file(self.path_for(user_id), strict)
+
+    def read_document(self, key: str, user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        """One of the user's side documents; missing documents are empty"""
+        return self._read_file(self.document_path(key, user_id))
+
+    def expire_users(self, prefix: str, older_than: float) -> int:
+        """Delete the shards (and side documents) of prefix users not written since older_than; returns files removed"""
+        if prefix != SESSION_USER_PREFIX or not os.path.isdir(self.shards_dir):
+            # Other ids are only known by their digest
+            return 0
+        removed = 0
+        for name in os.listdir(self.shards_dir):
+            if not (name.startswith(prefix) and name.endswith(".json")):
+                continue
+            path = os.path.join(self.shards_dir, name)
+            try:
+                if os.stat(path).st_mtime >= older_than:
+                    continue
+                os.unlink(path)
+                removed += 1
+                if os.path.exists(path + ".lock"):
+                    os.unlink(path + ".lock")
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def change_token(self, user_id: str = DEFAULT_USER_ID) -> Hashable:
+        """Cheap value that changes whenever the user's file is rewritten (atomic renames change the inode)"""
+        try:
+            file_stat = os.stat(self.path_for(user_id))
+        except FileNotFoundError:
+            return None
+        return (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+
+    def document_change_token(self, key: str, user_id: str = DEFAULT_USER_ID) -> Hashable:
+        try:
+            file_stat = os.stat(self.document_path(key, user_id))
+        except FileNotFoundError:
+            return None
+        return (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+
+    def _write(self, path: str, body_data: Dict[str, Any]) -> None:
+        """Write body_data to a temp file in the same directory and rename it into place"""
+        directory = os.path.dirname(os.path.abspath(path))
+        tmp_path = os.path.join(directory, f".body-{os.urandom(8).hex()}.json.tmp")
+        # Created like open(path, "w") would, so the kernel applies the umask to new files
+        fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+        try:
+            with os.fdopen(fd, "w") as f:
+                # Keep the mode of the file being replaced
+                try:
+                    os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+                except FileNotFoundError:
+                    pass
+                json.dump(body_data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @contextmanager
+    def transaction(self, user_id: str = DEFAULT_USER_ID) -> Iterator[Dict[str, Any]]:
+        """
+        Read-modify-write transaction. Yields the user's body state; changes made to it
+        are written atomically when the block exits without an exception.
+        """
+        with self._file_transaction(self.path_for(user_id)) as body_data:
+            yield body_data
+
+    @contextmanager
+    def document_transaction(self, key: str, user_id: str = DEFAULT_USER_ID) -> Iterator[Dict[str, Any]]:
+        """Read-modify-write transaction over one of the user's side documents"""
+        with self._file_transaction(self.document_path(key, user_id)) as document:
+            yield document
+
+    @contextmanager
+    def _file_transaction(self, path: str) -> Iterator[Dict[str, Any]]:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._thread_lock, self._file_lock(path):
+            data = self._read_file(path, strict=True)
+            yield data
+            self._write(path, data)
+
+    def merge(self, updates: Dict[str, Any], user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        """Merge per-muscle-group updates (e.g. an LLM response_json) and return the new state"""
+        with self.transaction(user_id) as body_data:
+            _merge_updates(body_data, updates)
+        return body_data
+
+class SQLiteBodyStore:
+    """
+    SQLite (WAL) backend for body state with one row per (user, muscle group).
+    Merges are row-level upserts of the touched muscle groups instead of whole-document rewrites.
+    On first open, an existing legacy body.json is imported as the default user's state.
+    """
+    def __init__(self, path: str = BODY_DB_PATH, legacy_json_path: str = BODY_JSON_PATH):
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self._local = threading.local()
+        self._init_db()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads, so each thread gets its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write_transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _init_db(self) -> None:
+        with self._write_transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS body_state ("
+                " user_id TEXT NOT NULL,"
+                " muscle_group TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (user_id, muscle_group))"
+            )
+            # Side documents such as the MCP muscle statuses, kept out of the body state
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " user_id TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " revision INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (user_id, key))"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+            if "revision" not in columns:
+                conn.execute("ALTER TABLE documents ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            migrated = conn.execute("SELECT value FROM meta WHERE key = 'migrated_body_json'").fetchone()
+            if migrated is None:
+                self._migrate_legacy_json(conn)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_body_json', ?)", (str(time.time()),))
+
+    def _migrate_legacy_json(self, conn: sqlite3.Connection) -> None:
+        """Import the shared body.json as the default user's rows"""
+        # A corrupt body.json raises, so it is not marked as migrated and its state is not lost
+        legacy = BodyStore(self.legacy_json_path).read(strict=True)
+        if not legacy:
+            return
+        existing = conn.execute("SELECT 1 FROM body_state WHERE user_id = ? LIMIT 1", (DEFAULT_USER_ID,)).fetchone()
+        if existing is None:
+            self._upsert(conn, DEFAULT_USER_ID, legacy)
+
+    def _upsert(self, conn: sqlite3.Connection, user_id: str, rows: Dict[str, Any]) -> None:
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO body_state (user_id, muscle_group, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (user_id, muscle_group) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            [(user_id, muscle_group, json.dumps(info), now) for muscle_group, info in rows.items()],
+        )
+
+    def _read_rows(self, conn: sqlite3.Connection, user_id: str, muscle_groups=None) -> Dict[str, Any]:
+        if muscle_groups is None:
+            cursor = conn.execute(
+                "SELECT muscle_group, data FROM body_state WHERE user_id = ? ORDER BY rowid", (user_id,)
+            )
+        else:
+            placeholders = ", ".join("?" * len(muscle_groups))
+            cursor = conn.execute(
+                f"SELECT muscle_group, data FROM body_state WHERE user_id = ? AND muscle_group IN ({placeholders})",
+                (user_id, *muscle_groups),
+            )
+        return {muscle_group: json.loads(data) for muscle_group, data in cursor}
+
+    def read(self, user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        """Read a user's body state as a {muscle_group: info} document"""
+        return self._read_rows(self._connection(), user_id)
+
+    def expire_users(self, prefix: str, older_than: float) -> int:
+        """Delete all rows of prefix users whose latest write is older than older_than; returns rows removed"""
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        removed = 0
+        with self._write_transaction() as conn:
+            for table, key in (("body_state", "muscle_group"), ("documents", "key")):
+                removed += conn.execute(
+                    f"DELETE FROM {table} WHERE user_id IN ("
+                    f" SELECT user_id FROM {table} WHERE user_id LIKE ? ESCAPE '\\'"
+                    f" GROUP BY user_id HAVING max(updated_at) < ?)",
+                    (pattern, older_than),
+                ).rowcount
+        return removed
+
+    def change_token(self, user_id: str = DEFAULT_USER_ID) -> Hashable:
+        """Cheap value that changes whenever any of the user's rows is written or deleted"""
+        return self._connection().execute(
+            "SELECT count(*), max(updated_at) FROM body_state WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+    @contextmanager
+    def transaction(self, user_id: str = DEFAULT_USER_ID) -> Iterator[Dict[str, Any]]:
+        """
+        Read-modify-write transaction over a user's whole document.
+        Only rows that changed are upserted, and groups removed from the document are deleted.
+        """
+        with self._write_transaction() as conn:
+            body_data = self._read_rows(conn, user_id)
+            original = {muscle_group: json.dumps(info) for muscle_group, info in body_data.items()}
+            yield body_data
+            changed = {
+                muscle_group: info for muscle_group, info in body_data.items()
+                if original.get(muscle_group) != json.dumps(info)
+            }
+            self._upsert(conn, user_id, changed)
+            removed = [(user_id, muscle_group) for muscle_group in original if muscle_group not in body_data]
+            conn.executemany("DELETE FROM body_state WHERE user_id = ? AND muscle_group = ?", removed)
+
+    def merge(self, updates: Dict[str, Any], user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        """Upsert only the muscle groups named in updates, then return the user's new state"""
+        if updates:
+            with self._write_transaction() as conn:
+                touched = self._read_rows(conn, user_id, list(updates))
+                _merge_updates(touched, updates)
+                self._upsert(conn, user_id, {muscle_group: touched[muscle_group] for muscle_group in updates})
+        return self.read(user_id)
+
+    def _read_document(self, conn: sqlite3.Connection, key: str, user_id: str) -> Dict[str, Any]:
+        row = conn.execute("SELECT data FROM documents WHERE user_id = ? AND key = ?", (user_id, key)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def read_document(self, key: str, user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        """One of the user's side documents; missing documents are empty"""
+        return self._read_document(self._connection(), key, user_id)
+
+    def document_change_token(self, key: str, user_id: str = DEFAULT_USER_ID) -> Hashable:
+        """The document's revision, bumped by every write that changes it; None if it does not exist"""
+        row = self._connection().execute(
+            "SELECT revision FROM documents WHERE user_id = ? AND key = ?", (user_id, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    @contextmanager
+    def document_transaction(self, key: str, user_id: str = DEFAULT_USER_ID) -> Iterator[Dict[str, Any]]:
+        """Read-modify-write transaction over one of the user's side documents; unchanged documents are not written"""
+        with self._write_transaction() as conn:
+            document = self._read_document(conn, key, user_id)
+            original = json.dumps(document)
+            yield document
+            data = json.dumps(document)
+            if data != original:
+                conn.execute(
+                    "INSERT INTO documents (user_id, key, data, updated_at, revision) VALUES (?, ?, ?, ?, 1) "
+                    "ON CONFLICT (user_id, key) DO UPDATE SET"
+                    " data = excluded.data, updated_at = excluded.updated_at, revision = documents.revision + 1",
+                    (user_id, key, data, time.time()),
+                )
+
+class BodySnapshot:
+    """One user's body state at a given version. Shared between sessions, so treat data as read-only."""
+    def __init__(self, version: int, data: Dict[str, Any], token: Hashable):
+        self.version = version
+        self.data = data
+        self.token = token
+
+    @cached_property
+    def prompt_json(self) -> str:
+        """The state serialized for the LLM prompt, computed once per version"""
+        return json.dumps(self.data)
+
+class CachedBodyStore:
+    """
+    Process-wide in-memory cache in front of a body-state backend.
+    Each user's state is parsed once and reused until the backend's change token moves
+    (a write from another process, or a file edited on disk) or a write goes through this cache.
+    Every reload bumps a process-wide version counter.
+    """
+    def __init__(self, store=None, opener: Optional[Callable[[], Any]] = None):
+        self._store = store
+        self._opener = opener
+        self._open_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._snapshots: "OrderedDict[str, BodySnapshot]" = OrderedDict()
+        self._version = 0
+
+    @property
+    def store(self):
+        """The backend, opened on first use so importing this module creates no files"""
+        if self._store is None:
+            with self._open_lock:
+                if self._store is None:
+                    self._store = (self._opener or open_body_store)()
+        return self._store
+
+    def snapshot(self, user_id: str = DEFAULT_USER_ID) -> BodySnapshot:
+        """Current snapshot of a user's state, reloading it only if it changed"""
+        token = self.store.change_token(user_id)
+        with self._lock:
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is not None and snapshot.token == token:
+                self._snapshots.move_to_end(user_id)
+                return snapshot
+
+        data = self.store.read(user_id)
+        with self._lock:
+            self._version += 1
+            snapshot = BodySnapshot(self._version, data, token)
+            self._snapshots[user_id] = snapshot
+            self._snapshots.move_to_end(user_id)
+            while len(self._snapshots) > MAX_CACHED_USERS:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id: str = DEFAULT_USER_ID) -> None:
+        with self._lock:
+            self._snapshots.pop(user_id, None)
+
+    def read(self, user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        """Cached body state for a user; do not mutate the returned dict, use merge or transaction"""
+        return self.snapshot(user_id).data
+
+    @contextmanager
+    def transaction(self, user_id: str = DEFAULT_USER_ID) -> Iterator[Dict[str, Any]]:
+        try:
+            with self.store.transaction(user_id) as body_data:
+                yield body_data
+        finally:
+            self.invalidate(user_id)
+
+    def merge(self, updates: Dict[str, Any], user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        """Merge updates through the backend and return the user's new (cached) state"""
+        try:
+            self.store.merge(updates, user_id)
+        finally:
+            self.invalidate(user_id)
+        return self.read(user_id)
+
+    def expire_users(self, prefix: str, older_than: float) -> int:
+        removed = self.store.expire_users(prefix, older_than)
+        with self._lock:
+            for user_id in [user_id for user_id in self._snapshots if user_id.startswith(prefix)]:
+                del self._snapshots[user_id]
+        return removed
+
+    # Side documents are not part of the body state snapshots, so they bypass the cache
+    def read_document(self, key: str, user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+        return self.store.read_document(key, user_id)
+
+    def document_change_token(self, key: str, user_id: str = DEFAULT_USER_ID) -> Hashable:
+        return self.store.document_change_token(key, user_id)
+
+    def document_transaction(self, key: str, user_id: str = DEFAULT_USER_ID):
+        return self.store.document_transaction(key, user_id)
+
+BODY_STORE_BACKENDS = {
+    "json": BodyStore,
+    "sqlite": SQLiteBodyStore,
+}
+
+def open_body_store(backend: str = None):
+    """Open the body-state backend named by backend or the BODY_STORE_BACKEND env var (default sqlite)"""
+    backend = backend or os.getenv("BODY_STORE_BACKEND", "sqlite")
+    if backend not in BODY_STORE_BACKENDS:
+        raise ValueError(f"Unknown body store backend: {backend}")
+    return BODY_STORE_BACKENDS[backend]()
+
+# Opened lazily by the first read or write
+body_store = CachedBodyStore()
+
+def _stress_worker(backend: str, path: str, worker_id: int, iterations: int) -> None:
+    """Increment a per-worker counter and a shared counter in their own transactions"""
+    store = BODY_STORE_BACKENDS[backend](path)
+    for _ in range(iterations):
+        with store.transaction() as body_data:
+            counters = body_data.setdefault("counters", {})
+            counters["shared"] = counters.get("shared", 0) + 1
+            counters[str(worker_id)] = counters.get(str(worker_id), 0) + 1
+
+def stress_test(backend: str = "json", processes: int = 4, threads: int = 8, iterations: int = 50) -> bool:
+    """
+    Hammer a scratch store from many threads in many processes and check that no update was lost.
+    Run with: python body_store.py [json|sqlite]
+    """
+    import multiprocessing
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "body.json" if backend == "json" else "body_state.db")
+        # Create the schema up front so workers don't race on it
+        BODY_STORE_BACKENDS[backend](path)
+
+        start = time.perf_counter()
+        procs = [
+            multiprocessing.Process(target=_stress_worker, args=(backend, path, 1000 + p, iterations * threads))
+            for p in range(processes)
+        ]
+        workers = [
+            threading.Thread(target=_stress_worker, args=(backend, path, t, iterations))
+            for t in range(threads)
+        ]
+        for worker in procs + workers:
+            worker.start()
+        for worker in procs + workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        counters = BODY_STORE_BACKENDS[backend](path).read().get("counters", {})
+        expected = (processes + 1) * threads * iterations
+        ok = counters.get("shared") == expected and all(
+            counters.get(str(worker_id)) == iterations for worker_id in range(threads)
+        )
+        print(f"[{backend}] {expected} transactions in {elapsed:.2f}s, shared counter {counters.get('shared')}: {'OK' if ok else 'LOST UPDATES'}")
+        return ok
+
+if __name__ == "__main__":
+    backends = sys.argv[1:] or list(BODY_STORE_BACKENDS)
+    results = [stress_test(backend) for backend in backends]
+    sys.exit(0 if all(results) else 1)
@@ -1,9 +1,47 @@
 import streamlit as st
-import asyncio
 import speech_recognition as sr
-import os
-import json
-from tools import generate_chat_analysis, get_audio_input
+from tools import ChatAnalysisStream, collect_chat_messages, get_audio_input
+from body_store import body_store
+from user_session import session_user_id
+from event_loop import background_loop
+
+def _render_stream(stream: ChatAnalysisStream, placeholder) -> None:
+    """Render streamed text into a placeholder as it arrives from the background loop"""
+    text = ""
+    with collect_chat_messages():
+        for delta in background_loop.iterate(stream):
+            text += delta
+            placeholder.markdown(text + "▌")
+    placeholder.markdown(text)
+
+def stream_response(chatbox, latest_user_message, body_json):
+    """Stream the assistant's reply to latest_user_message into the chatbox and add it to history"""
+    stream = ChatAnalysisStream(
+        latest_user_message,
+        chat_history=st.session_state.chat_history[:-1],  # Exclude the latest message
+        body_json=body_json,
+        focus_groups=st.session_state.get("recent_muscle_groups"),  # Groups the last reply updated
+    )
+    with chatbox.chat_message("assistant"):
+        placeholder = st.empty()
+        placeholder.markdown("_Analyzing your input..._")
+        _render_stream(stream, placeholder)
+    
+    response = stream.result
+    
+    # Check if response is a tuple (meaning it contains JSON data)
+    if isinstance(response, tuple) and len(response) == 2:
+        actual_response, response_json = response
+        
+        # Upsert the new info into this user's body state
+        body_store.merge(response_json, session_user_id())
+        st.session_state.recent_muscle_groups = list(response_json)
+        
+        # Add assistant message to history
+        st.session_state.chat_history.append({"role": "assistant", "content": actual_response})
+    else:
+        # If just a string response, add it to history as is
+        st.session_state.chat_history.append({"role": "assistant", "content": response})
 
 def chatbot():
     # Initialize chat history if not exists
@@ -40,19 +78,12 @@ def chatbot():
         </style>
     """, unsafe_allow_html=True)
     
-    # Load body.json if it exists
-    json_path = "body.json"
-    if os.path.exists(json_path):
-        with open(json_path, "r") as f:
-            try:
-                body_data = json.load(f)
-            except json.JSONDecodeError:
-                body_data = {}
-    else:
-        body_data = {}
+    # Load this user's body state
+    body_state = body_store.snapshot(session_user_id())
+    body_data = body_state.data
     
-    # Convert to string for passing to the LLM
-    body_json = json.dumps(body_data)
+    # String for passing to the LLM, serialized once per body-state version
+    body_json = body_state.prompt_json
     
     # Handle form submission for text input
     def handle_text_submit():
@@ -72,6 +103,20 @@ def chatbot():
             # Indicate reprocessing needed
             st.session_state.needs_rerun = True
     
+    # Create the chat container first so replies can stream into it
+    chatbox = st.container(height=800)
+    
+    # Display all messages from chat history
+    for message in st.session_state.chat_history:
+        role = message["role"]
+        content = message["content"]
+        with chatbox.chat_message(role):
+            # Check if the message is an HTML-formatted stretches message
+            if "<div style=" in content and "Stretches for" in content:
+                st.markdown(content, unsafe_allow_html=True)
+            else:
+                st.markdown(content)
+    
     # Handle text processing outside form to prevent infinite loops
     if st.session_state.get("needs_rerun", False) and st.session_state.processing_text:
         # Reset flag
@@ -82,54 +127,13 @@ def chatbot():
                                    if msg["role"] == "user"), None)
         
         if latest_user_message:
-            with st.spinner("Analyzing your input..."):
-                # Pass chat history for context and body_json for updating
-                response = asyncio.run(generate_chat_analysis(
-                    latest_user_message, 
-                    chat_history=st.session_state.chat_history[:-1],  # Exclude the latest message
-                    body_json=body_json
-                ))
-                
-                # Check if response is a tuple (meaning it contains JSON data)
-                if isinstance(response, tuple) and len(response) == 2:
-                    actual_response, response_json = response
-                    
-                    # Update existing JSON data with new info from response
-                    for muscle_group, info in response_json.items():
-                        if muscle_group in body_data:
-                            # Update existing muscle group data
-                            body_data[muscle_group].update(info)
-                        else:
-                            # Add new muscle group data
-                            body_data[muscle_group] = info
-                    
-                    # Save the updated JSON to file
-                    with open(json_path, "w") as f:
-                        json.dump(body_data, f, indent=2)
-                    
-                    # Add assistant message to history
-                    st.session_state.chat_history.append({"role": "assistant", "content": actual_response})
-                else:
-                    # If just a string response, add it to history as is
-                    st.session_state.chat_history.append({"role": "assistant", "content": response})
+            # Stream the reply into the chat, then record it and apply any body-state updates
+            stream_response(chatbox, latest_user_message, body_json)
         
         # Reset flag
         st.session_state.processing_text = False
         st.rerun()
     
-    chatbox = st.container(height=800)
-    
-    # Display all messages from chat history
-    for message in st.session_state.chat_history:
-        role = message["role"]
-        content = message["content"]
-        with chatbox.chat_message(role):
-            # Check if the message is an HTML-formatted stretches message
-            if "<div style=" in content and "Stretches for" in content:
-                st.markdown(content, unsafe_allow_html=True)
-            else:
-                st.markdown(content)
-    
     # Display any new MCP messages
     if st.session_state.mcp_messages:
         for message in st.session_state.mcp_messages:
@@ -174,36 +178,8 @@ def chatbot():
                                     if msg["role"] == "user"), None)
         
         if latest_user_message:
-            with st.spinner("Analyzing your input..."):
-                # Pass chat history for context and body_json for updating
-                response = asyncio.run(generate_chat_analysis(
-                    latest_user_message,
-                    chat_history=st.session_state.chat_history[:-1],  # Exclude the latest message
-                    body_json=body_json
-                ))
-                
-                # Check if response is a tuple (meaning it contains JSON data)
-                if isinstance(response, tuple) and len(response) == 2:
-                    actual_response, response_json = response
-                    
-                    # Update existing JSON data with new info from response
-                    for muscle_group, info in response_json.items():
-                        if muscle_group in body_data:
-                            # Update existing muscle group data
-                            body_data[muscle_group].update(info)
-                        else:
-                            # Add new muscle group data
-                            body_data[muscle_group] = info
-                    
-                    # Save the updated JSON to file
-                    with open(json_path, "w") as f:
-                        json.dump(body_data, f, indent=2)
-                    
-                    # Add assistant message to history
-                    st.session_state.chat_history.append({"role": "assistant", "content": actual_response})
-                else:
-                    # If just a string response, add it to history as is
-                    st.session_state.chat_history.append({"role": "assistant", "content": response})
+            # Stream the reply into the chat, then record it and apply any body-state updates
+            stream_response(chatbox, latest_user_message, body_json)
         
         # Reset flag
         st.session_state.processing_voice = False
@@ -0,0 +1,161 @@
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+# Token budget for the conversation history plus body state sent with each request
+CONTEXT_TOKEN_BUDGET = int(os.getenv("PHIZZY_CONTEXT_TOKEN_BUDGET", "3000"))
+# Most recent history messages that are always kept verbatim when they fit
+RECENT_MESSAGES = int(os.getenv("PHIZZY_CONTEXT_RECENT_MESSAGES", "6"))
+# Older messages are summarized this many at a time, so the summary and the first verbatim message
+# only change every SUMMARY_BLOCK_MESSAGES messages and the prompt prefix stays cacheable in between
+SUMMARY_BLOCK_MESSAGES = max(int(os.getenv("PHIZZY_CONTEXT_SUMMARY_BLOCK", "8")), 1)
+# Share of the budget the summary of earlier conversation may use
+SUMMARY_BUDGET_SHARE = 0.25
+# Share of the budget the body state may use before its relevant groups are trimmed too
+BODY_BUDGET_SHARE = 0.5
+# Characters kept per older message in the summary of earlier conversation
+SUMMARY_CHARS = 160
+# List items kept per field when a relevant muscle group still has to be trimmed
+TRIMMED_LIST_ITEMS = 2
+
+# Extra words that point at a body.json muscle group, keyed by the group's last word
+GROUP_SYNONYMS = {
+    "trap": ["traps", "trapezius", "neck"],
+    "shoulder": ["shoulders", "deltoid", "delts", "rotator"],
+    "chest": ["pec", "pecs", "pectoral"],
+    "bicep": ["biceps", "arm", "arms"],
+    "forearm": ["forearms", "wrist", "wrists", "elbow"],
+    "oblique": ["obliques", "side", "flank"],
+    "abs": ["abdominal", "abdominals", "stomach", "core"],
+    "groin": ["hip", "hips", "adductor", "adductors"],
+    "thigh": ["thighs", "quad", "quads", "hamstring", "hamstrings", "knee"],
+    "calf": ["calves", "shin", "ankle", "achilles"],
+}
+
+def count_tokens(text: str) -> int:
+    """Token count of text (tiktoken when installed, otherwise a 4-characters-per-token estimate)"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def _message_tokens(message: Dict[str, Any]) -> int:
+    # A few tokens of per-message overhead on top of the content
+    return count_tokens(message.get("content") or "") + 4
+
+def _words(text: str) -> Set[str]:
+    return set(re.findall(r"[a-z]+", text.lower()))
+
+def relevant_groups(body_data: Dict[str, Any], texts: Iterable[str]) -> Set[str]:
+    """Muscle groups in body_data that the given texts talk about"""
+    words: Set[str] = set()
+    for text in texts:
+        words |= _words(text)
+    relevant = set()
+    for group in body_data:
+        group_words = group.lower().split()
+        core = group_words[-1]
+        if core in words or words & set(GROUP_SYNONYMS.get(core, [])):
+            side = group_words[0] if group_words[0] in ("left", "right") else None
+            other_side = {"left": "right", "right": "left"}.get(side)
+            # "left calf" is not relevant when only the right side is mentioned
+            if side is None or side in words or other_side not in words:
+                relevant.add(group)
+    return relevant
+
+def compact_body(body_data: Dict[str, Any], keep_full: Set[str], trim_lists: bool = False) -> Dict[str, Any]:
+    """
+    Keep full details only for keep_full groups; every other group is reduced to its pain level.
+    With trim_lists, list fields of the kept groups are cut to TRIMMED_LIST_ITEMS items.
+    """
+    compact = {}
+    for group, info in body_data.items():
+        if not isinstance(info, dict):
+            continue
+        if group in keep_full:
+            if trim_lists:
+                info = {key: value[:TRIMMED_LIST_ITEMS] if isinstance(value, list) else value for key, value in info.items()}
+            compact[group] = info
+        elif info.get("pain_level") not in (None, ""):
+            compact[group] = {"pain_level": info["pain_level"]}
+    return compact
+
+def _summarize(messages: List[Dict[str, Any]]) -> str:
+    lines = []
+    for message in messages:
+        content = " ".join(str(message.get("content") or "").split())
+        if len(content) > SUMMARY_CHARS:
+            content = content[:SUMMARY_CHARS].rstrip() + "..."
+        lines.append(f"- {message['role']}: {content}")
+    return "Summary of earlier conversation:\n" + "\n".join(lines)
+
+def build_context(
+    user_input: str,
+    chat_history: List[Dict[str, Any]],
+    body_json: Optional[str],
+    focus_groups: Optional[Iterable[str]] = None,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+) -> Tuple[List[Dict[str, Any]], Optional[str], Dict[str, int]]:
+    """
+    Fit chat history and body state into a token budget before an LLM call.
+
+    The body state keeps full details for muscle groups mentioned in the current turn or recent
+    history and for focus_groups (e.g. groups changed by the last reply); the others shrink to their
+    pain level. At least the RECENT_MESSAGES most recent history messages are kept verbatim; older
+    ones are condensed into a single summary message in whole blocks of SUMMARY_BLOCK_MESSAGES,
+    oldest block dropped first when over budget. Both only change when a block fills up, so
+    consecutive requests share their leading messages for the provider's prompt cache.
+
+    Returns (history, body_json, stats) where stats holds tokens before and after compaction.
+    """
+    history = [message for message in chat_history if "Stretches for" not in (message.get("content") or "")]
+    # Index of the first verbatim message, moved forward a whole block at a time
+    split = max(len(history) - RECENT_MESSAGES, 0) // SUMMARY_BLOCK_MESSAGES * SUMMARY_BLOCK_MESSAGES
+    tokens_before = sum(_message_tokens(message) for message in history) + (count_tokens(body_json) if body_json else 0)
+
+    body_tokens = 0
+    if body_json:
+        try:
+            body_data = json.loads(body_json)
+        except json.JSONDecodeError:
+            body_data = None
+        if isinstance(body_data, dict):
+            recent_texts = [user_input] + [str(message.get("content") or "") for message in history[split:]]
+            keep_full = relevant_groups(body_data, recent_texts) | set(focus_groups or [])
+            body_json = json.dumps(compact_body(body_data, keep_full))
+            if count_tokens(body_json) > budget * BODY_BUDGET_SHARE:
+                body_json = json.dumps(compact_body(body_data, keep_full, trim_lists=True))
+        body_tokens = count_tokens(body_json)
+
+    remaining = budget - body_tokens
+    recent = history[split:]
+    older = history[:split]
+
+    # Drop the oldest of the recent messages if even they do not fit, but always keep the last exchange
+    while len(recent) > 2 and sum(_message_tokens(message) for message in recent) > remaining:
+        older.append(recent.pop(0))
+    remaining -= sum(_message_tokens(message) for message in recent)
+
+    # Condense older messages, newest block first, into the summary's share of the budget (or what is
+    # left, if less); a fixed share keeps the summary stable while the recent messages grow
+    summary_budget = min(budget * SUMMARY_BUDGET_SHARE, remaining)
+    summarized: List[Dict[str, Any]] = []
+    for end in range(len(older), 0, -SUMMARY_BLOCK_MESSAGES):
+        candidate = older[max(end - SUMMARY_BLOCK_MESSAGES, 0):end] + summarized
+        if _message_tokens({"content": _summarize(candidate)}) > summary_budget:
+            break
+        summarized = candidate
+
+    compacted = recent
+    if summarized:
+        compacted = [{"role": "system", "content": _summarize(summarized)}] + recent
+
+    tokens_after = sum(_message_tokens(message) for message in compacted) + body_tokens
+    stats = {"tokens_before": tokens_before, "tokens_after": tokens_after, "budget": budget}
+    return compacted, body_json, stats
@@ -0,0 +1,94 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import queue
+import threading
+from typing import Any, AsyncIterable, Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+class BackgroundLoop:
+    """
+    One long-lived asyncio event loop running in a daemon thread, shared by every Streamlit session.
+    Async clients created on it (e.g. the pooled OpenAI HTTP client) keep their connections across
+    messages instead of being torn down with a per-message asyncio.run loop.
+    Context variables of the submitting thread are visible to the submitted coroutine.
+    """
+    def __init__(self, name: str = "phizzy-event-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The running loop, started on first use"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._loop, ready), name=self.name, daemon=True)
+                self._thread.start()
+                ready.wait()
+            return self._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop, ready: threading.Event) -> None:
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        loop.run_forever()
+
+    def submit(self, coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+        """Schedule coro on the loop from any thread and return a concurrent future for its result"""
+        context_values = list(contextvars.copy_context().items())
+
+        async def run_in_callers_context() -> T:
+            # The task runs in its own copy of the loop's context; carry the caller's variables over
+            for var, value in context_values:
+                var.set(value)
+            return await coro
+
+        return asyncio.run_coroutine_threadsafe(run_in_callers_context(), self.loop)
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """Run coro on the loop and block the calling thread until it finishes (replaces asyncio.run)"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def iterate(self, aiterable: AsyncIterable[T]) -> Iterator[T]:
+        """
+        Consume an async iterable on the loop and yield its items in the calling thread as they arrive,
+        so e.g. streamed tokens can be rendered by the Streamlit script thread.
+        """
+        items: "queue.Queue[Any]" = queue.Queue()
+
+        async def pump() -> None:
+            try:
+                async for item in aiterable:
+                    items.put(item)
+            finally:
+                items.put(_DONE)
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item = items.get()
+                if item is _DONE:
+                    break
+                yield item
+            # Re-raise any error from the iterable
+            future.result()
+        finally:
+            future.cancel()
+
+background_loop = BackgroundLoop()
+
+def run_async(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """Run a coroutine on the shared background loop and wait for its result"""
+    return background_loop.run(coro, timeout)
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import struct
+from typing import Any, Dict, Optional
+
+# Binary encodings the server offers when installed; msgpack is in requirements.txt, cbor2 is optional
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# "line" is newline-delimited JSON, the default; "length-prefixed" puts a 4-byte big-endian length before each message
+FRAMINGS = ("line", "length-prefixed")
+FRAME_HEADER = struct.Struct(">I")
+
+class Codec:
+    """Turns one message into bytes and back. decode raises ValueError on malformed input."""
+    name = ""
+    # Used in error replies, e.g. "Invalid JSON"
+    label = ""
+
+    def encode(self, message: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+class JSONCodec(Codec):
+    name = "json"
+    label = "JSON"
+
+    def encode(self, message: Any) -> bytes:
+        return json.dumps(message).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data.decode())
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    label = "MessagePack"
+
+    def encode(self, message: Any) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise ValueError(f"Invalid msgpack: {e}") from e
+
+class CBORCodec(Codec):
+    name = "cbor"
+    label = "CBOR"
+
+    def encode(self, message: Any) -> bytes:
+        return cbor2.dumps(message)
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            return cbor2.loads(data)
+        except Exception as e:
+            raise ValueError(f"Invalid CBOR: {e}") from e
+
+def _available_codecs() -> Dict[str, Codec]:
+    codecs: Dict[str, Codec] = {"json": JSONCodec()}
+    if msgpack is not None:
+        codecs["msgpack"] = MsgpackCodec()
+    if cbor2 is not None:
+        codecs["cbor"] = CBORCodec()
+    return codecs
+
+CODECS = _available_codecs()
+
+def frame(payload: bytes) -> bytes:
+    """Length-prefix one encoded message"""
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+async def read_frame(reader: asyncio.StreamReader, max_bytes: int) -> Optional[bytes]:
+    """
+    Read one length-prefixed message; None at end of stream.
+    Raises ValueError when the announced length exceeds max_bytes, since the payload is never read.
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > max_bytes:
+        raise ValueError(f"Frame of {length} bytes exceeds {max_bytes}")
+    try:
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
@@ -0,0 +1,163 @@
+import os
+import re
+import sys
+from typing import Dict, List, Optional, Set, Tuple, get_args
+
+from muscle_groups import MUSCLE_GROUPS
+from mcp import MuscleType
+
+# Share of a message's words that must be explained by muscle phrases, stretch terms and filler
+INTENT_MIN_CONFIDENCE = float(os.getenv("PHIZZY_INTENT_MIN_CONFIDENCE", "0.75"))
+# Muscles a stretch request may name before it is left to a model
+INTENT_MAX_MUSCLES = int(os.getenv("PHIZZY_INTENT_MAX_MUSCLES", "2"))
+
+# Phrasings of each send_stretches muscle besides its own name
+MUSCLE_SYNONYMS: Dict[str, List[str]] = {
+    "hands": ["hand", "finger", "fingers", "palm", "palms"],
+    "forearms": ["forearm", "wrist", "wrists"],
+    "biceps": ["bicep", "upper arm", "upper arms"],
+    "front-shoulders": ["shoulder", "shoulders", "front shoulder", "front delt", "front delts", "deltoid", "deltoids"],
+    "chest": ["pec", "pecs", "pectoral", "pectorals"],
+    "obliques": ["oblique", "love handles"],
+    "abdominals": ["abs", "ab", "abdominal", "stomach", "core", "belly"],
+    "quads": ["quad", "quadricep", "quadriceps", "thigh", "thighs", "front of thigh", "front of my thigh"],
+    "calves": ["calf", "lower leg", "lower legs", "achilles"],
+    "triceps": ["tricep", "back of arm", "back of my arm", "back of arms", "back of my arms"],
+    "rear-shoulders": ["rear shoulder", "rear delt", "rear delts", "back of shoulder", "back of my shoulder"],
+    "traps": ["trap", "trapezius", "upper trap", "upper traps", "neck"],
+    "traps-middle": ["middle trap", "middle traps", "mid trap", "mid traps", "upper back", "shoulder blade", "shoulder blades"],
+    "lats": ["lat", "latissimus"],
+    "lowerback": ["lower back", "low back", "lumbar", "back"],
+    "hamstrings": ["hamstring", "hammy", "hammies", "back of thigh", "back of my thigh", "back of leg", "back of my leg"],
+    "glutes": ["glute", "butt", "buttock", "buttocks"],
+}
+
+# send_stretches muscle for each body.json group, keyed by the group's last word
+GROUP_MUSCLES = {
+    "trap": "traps",
+    "shoulder": "front-shoulders",
+    "chest": "chest",
+    "bicep": "biceps",
+    "forearm": "forearms",
+    "oblique": "obliques",
+    "abs": "abdominals",
+    "thigh": "quads",
+    "calf": "calves",
+}
+
+STRETCH_TERMS = {
+    "stretch", "stretches", "stretching", "exercise", "exercises", "routine", "routines",
+    "mobility", "loosen", "release",
+}
+# Words that do not change what a stretch request is about
+FILLER_WORDS = {
+    "a", "an", "the", "some", "any", "few", "more", "other", "good", "best", "quick", "easy", "simple", "gentle",
+    "me", "my", "i", "you", "your", "it", "them", "for", "of", "to", "on", "and", "or", "with", "up", "out",
+    "show", "give", "send", "get", "need", "want", "like", "please", "pls", "do",
+    "about", "recommend", "suggest", "help", "try",
+    "left", "right", "both", "sides", "muscle", "muscles", "area",
+}
+# Negation and safety words: a message asking what to avoid or whether something is safe needs a model,
+# however well its other words match
+BLOCKING_WORDS = {
+    "no", "not", "don", "dont", "never", "avoid", "avoiding", "bad", "worst", "safe", "safely", "unsafe",
+    "should", "shouldn", "instead", "without", "stop", "dangerous", "harmful", "wrong", "careful",
+}
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"[a-z]+", text.lower())
+
+def _build_index() -> Dict[Tuple[str, ...], str]:
+    """Phrase (as a token tuple) -> send_stretches muscle"""
+    index: Dict[Tuple[str, ...], str] = {}
+    for muscle in dict.fromkeys(get_args(MuscleType)):
+        for phrase in [muscle] + MUSCLE_SYNONYMS.get(muscle, []):
+            index[tuple(_tokens(phrase))] = muscle
+    # body.json / diagram group names such as "right calf"
+    for group in MUSCLE_GROUPS.values():
+        muscle = GROUP_MUSCLES.get(group.split()[-1])
+        if muscle:
+            index[tuple(_tokens(group))] = muscle
+    return index
+
+MUSCLE_INDEX = _build_index()
+MAX_PHRASE_TOKENS = max(len(phrase) for phrase in MUSCLE_INDEX)
+
+class StretchIntent:
+    """A message asking for stretches for muscles, with the share of its words the match explains"""
+    def __init__(self, muscles: List[str], confidence: float):
+        self.muscles = muscles
+        self.confidence = confidence
+
+def find_muscles(tokens: List[str]) -> Tuple[List[str], Set[int]]:
+    """Muscles named in tokens, longest phrase first, and the token positions those phrases cover"""
+    muscles: List[str] = []
+    covered: Set[int] = set()
+    i = 0
+    while i < len(tokens):
+        for length in range(min(MAX_PHRASE_TOKENS, len(tokens) - i), 0, -1):
+            muscle = MUSCLE_INDEX.get(tuple(tokens[i:i + length]))
+            if muscle:
+                if muscle not in muscles:
+                    muscles.append(muscle)
+                covered.update(range(i, i + length))
+                i += length
+                break
+        else:
+            i += 1
+    return muscles, covered
+
+def match_stretch_intent(text: str, min_confidence: float = INTENT_MIN_CONFIDENCE) -> Optional[StretchIntent]:
+    """
+    Match messages like "show me right calf stretches" to send_stretches muscles without a model.
+    Returns None unless the message asks for stretches, names 1..INTENT_MAX_MUSCLES muscles, has no
+    BLOCKING_WORDS and nearly all of its words are accounted for.
+    """
+    tokens = _tokens(text)
+    if not STRETCH_TERMS.intersection(tokens) or BLOCKING_WORDS.intersection(tokens):
+        return None
+    muscles, covered = find_muscles(tokens)
+    if not 0 < len(muscles) <= INTENT_MAX_MUSCLES:
+        return None
+    explained = sum(
+        1 for position, token in enumerate(tokens)
+        if position in covered or token in STRETCH_TERMS or token in FILLER_WORDS
+    )
+    confidence = explained / len(tokens)
+    if confidence < min_confidence:
+        return None
+    return StretchIntent(muscles, confidence)
+
+# (message, muscles a direct stretch card should be sent for, or None when a model must answer)
+SELF_TEST_CASES = [
+    ("Show me hamstring stretches", ["hamstrings"]),
+    ("stretches for my right calf please", ["calves"]),
+    ("can you show me calf stretches", ["calves"]),
+    ("give me some quick stretches for my neck and lower back", ["traps", "lowerback"]),
+    ("quad stretch", ["quads"]),
+    ("which exercises should I avoid for my lower back", None),
+    ("what stretches are bad for my calf", None),
+    ("are calf stretches safe?", None),
+    ("no stretches for my calf please", None),
+    ("don't send me calf stretches", None),
+    ("what can I do instead of calf stretches", None),
+    ("is it ok to stretch my hamstrings", None),
+    ("how do I stretch my calf without pain", None),
+    ("stretches for my calf, shoulders and chest", None),
+    ("my calf hurts", None),
+]
+
+def self_test() -> bool:
+    """Check match_stretch_intent against SELF_TEST_CASES. Run with: python intent.py"""
+    failures = 0
+    for message, expected in SELF_TEST_CASES:
+        intent = match_stretch_intent(message)
+        got = intent.muscles if intent else None
+        if got != expected:
+            failures += 1
+            print(f"MISMATCH {message!r}: got {got}, expected {expected}")
+    print(f"{len(SELF_TEST_CASES)} phrasings: {'OK' if failures == 0 else f'{failures} MISMATCHES'}")
+    return failures == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if self_test() else 1)
@@ -0,0 +1,179 @@
+import json
+import random
+import sys
+from typing import Any, List, Optional
+
+_JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class JsonFieldStreamer:
+    """
+    Incrementally extracts the text of one top-level field from a JSON object that arrives in chunks.
+    A string value is emitted as it is decoded; an array of strings is emitted joined with newlines,
+    and a number, true, false or null once it is complete, matching how the full "actual query response"
+    is displayed once parsed. An object value emits nothing.
+    """
+    def __init__(self, field: str):
+        self.field = field
+        self.depth = 0
+        self.expect_key = False
+        self.in_string = False
+        self.string_role = None
+        self.escape = None
+        self.high_surrogate = None
+        self.key_chars: List[str] = []
+        self.last_key = None
+        self.value_pending = False
+        self.capture_depth = None
+        self.items_emitted = 0
+        # Characters of a scalar (number, true, false, null) value of the field, while it is being read
+        self.scalar_chars: Optional[List[str]] = None
+
+    def feed(self, chunk: str) -> str:
+        """Consume the next chunk of raw JSON and return any newly decoded text of the field"""
+        out: List[str] = []
+        for ch in chunk:
+            if self.in_string:
+                self._string_char(ch, out)
+            else:
+                self._structural_char(ch, out)
+        return "".join(out)
+
+    def _emit(self, text: str, out: List[str]) -> None:
+        if self.string_role == "key":
+            self.key_chars.append(text)
+        elif self.string_role == "capture":
+            out.append(text)
+
+    def _string_char(self, ch: str, out: List[str]) -> None:
+        if self.escape is not None:
+            self.escape += ch
+            if self.escape[0] == "u":
+                if len(self.escape) < 5:
+                    return
+                code = int(self.escape[1:], 16)
+                self.escape = None
+                if 0xD800 <= code < 0xDC00:
+                    self.high_surrogate = code
+                    return
+                if 0xDC00 <= code < 0xE000 and self.high_surrogate is not None:
+                    code = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                self.high_surrogate = None
+                self._emit(chr(code), out)
+            else:
+                decoded = _JSON_ESCAPES.get(self.escape, self.escape)
+                self.escape = None
+                self._emit(decoded, out)
+        elif ch == "\\":
+            self.escape = ""
+        elif ch == '"':
+            self.in_string = False
+            if self.string_role == "key":
+                self.last_key = "".join(self.key_chars)
+                self.expect_key = False
+            elif self.string_role == "capture":
+                self.items_emitted += 1
+                if self.capture_depth == 1:
+                    # A plain string value is complete
+                    self.capture_depth = None
+            self.string_role = None
+        else:
+            self._emit(ch, out)
+
+    def _structural_char(self, ch: str, out: List[str]) -> None:
+        if self.scalar_chars is not None:
+            if ch not in ",}]" and not ch.isspace():
+                self.scalar_chars.append(ch)
+                return
+            self._finish_scalar(out)
+        if ch.isspace():
+            return
+        if self.value_pending:
+            # First character of the target field's value decides how it is captured
+            self.value_pending = False
+            if ch == '"':
+                self.capture_depth = 1
+            elif ch == "[":
+                self.capture_depth = 2
+            elif ch != "{":
+                self.scalar_chars = [ch]
+                return
+
+        if ch == '"':
+            self.in_string = True
+            if self.depth == 1 and self.expect_key:
+                self.string_role = "key"
+                self.key_chars = []
+            elif self.capture_depth == self.depth:
+                self.string_role = "capture"
+                if self.capture_depth == 2 and self.items_emitted:
+                    out.append("\n")
+            else:
+                self.string_role = None
+        elif ch in "{[":
+            self.depth += 1
+            if self.depth == 1 and ch == "{":
+                self.expect_key = True
+        elif ch in "}]":
+            if self.capture_depth == 2 and self.depth == 2:
+                self.capture_depth = None
+            self.depth -= 1
+        elif ch == "," and self.depth == 1:
+            self.expect_key = True
+        elif ch == ":" and self.depth == 1:
+            self.value_pending = self.last_key == self.field
+
+    def _finish_scalar(self, out: List[str]) -> None:
+        literal = "".join(self.scalar_chars)
+        self.scalar_chars = None
+        try:
+            value = json.loads(literal)
+        except ValueError:
+            value = literal
+        # Shown the way the parsed reply displays it, e.g. 5 -> "5", true -> "True"
+        out.append(str(value))
+
+def _displayed(value: Any) -> str:
+    """The field as the parsed reply displays it"""
+    return "\n".join(value) if isinstance(value, list) else str(value)
+
+def self_test(chunkings: int = 200, seed: int = 0) -> bool:
+    """
+    Stream JSON replies through JsonFieldStreamer split at random chunk boundaries (and one character
+    at a time) and check the text equals the parsed field. Run with: python json_stream.py
+    """
+    rng = random.Random(seed)
+    field = "actual query response"
+    values = [
+        "plain text", "", "quotes \" and \\ backslashes / slashes", "escapes \n\t\r\b\f",
+        "unicode \u00e9 \u2713 \U0001F600 \u2028", ["first line", "second \"line\"", "\U0001F600"], [],
+        5, 0, -1.5e3, True, False, None,
+    ]
+    replies = 0
+    failures = 0
+    for value in values:
+        for ensure_ascii in (True, False):
+            for indent in (None, 2):
+                groups = [
+                    ("right calf", {"pain_level": "5", "notes": ["a", "b"]}),
+                    ("left calf", {"nested": [1, {field: "not the top-level field"}]}),
+                ]
+                groups.insert(rng.randint(0, len(groups)), (field, value))
+                text = json.dumps(dict(groups), ensure_ascii=ensure_ascii, indent=indent)
+                expected = _displayed(value)
+                replies += 1
+                splits = [list(text)]
+                for _ in range(chunkings):
+                    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, min(20, len(text) - 1))))
+                    splits.append([text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])])
+                for chunks in splits:
+                    streamer = JsonFieldStreamer(field)
+                    streamed = "".join(streamer.feed(chunk) for chunk in chunks)
+                    if streamed != expected:
+                        failures += 1
+                        if failures <= 5:
+                            print(f"MISMATCH for {text!r} split as {chunks!r}: streamed {streamed!r}, expected {expected!r}")
+    print(f"{replies} replies x {chunkings + 1} chunkings: {'OK' if failures == 0 else f'{failures} MISMATCHES'}")
+    return failures == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if self_test() else 1)
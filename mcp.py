@@ -1,7 +1,10 @@
 import asyncio
-import json
-from typing import Dict, List, Literal, Optional, Any, Callable, Awaitable
+import os
+from typing import Dict, List, Literal, Optional, Any, Callable, Awaitable, Union, get_args
 from muscle_stretch_summaries import muscle_stretch_summaries
+from muscle_state import MUSCLE_STATE_RECHECK_S, MuscleSnapshot, MuscleStateStore
+from framing import CODECS, FRAMINGS, frame, read_frame
+from pubsub import SUBSCRIBER_OVERFLOW, SUBSCRIBER_QUEUE_SIZE, TOPICS, EventHub, Subscriber
 
 MuscleStatus = Literal["green", "orange", "red"]
 MuscleType = Literal[
@@ -11,13 +14,39 @@ MuscleType = Literal[
     "lowerback", "hamstrings", "glutes", "calves",
 ]
 
+# Muscle statuses shared by every MCPServer in the process
+muscle_state = MuscleStateStore(get_args(MuscleType), get_args(MuscleStatus))
+
+# Requests one connection may have in flight before the server stops reading from it
+MAX_INFLIGHT_PER_CONNECTION = int(os.getenv("PHIZZY_MCP_MAX_INFLIGHT", "32"))
+
+# Longest request line the server reads; batch frames can be far larger than the 64 KiB asyncio default
+MAX_FRAME_BYTES = int(os.getenv("PHIZZY_MCP_MAX_FRAME_BYTES", str(4 * 1024 * 1024)))
+# Most requests a single batch frame may carry
+MAX_BATCH_SIZE = int(os.getenv("PHIZZY_MCP_MAX_BATCH_SIZE", "1000"))
+
+# Stands in for a request line or frame that failed to decode
+INVALID_JSON = object()
+
 class MCPServer:
-    def __init__(self, host: str = "localhost", port: int = 8000):
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 8000,
+        max_inflight: int = MAX_INFLIGHT_PER_CONNECTION,
+        state: Optional[MuscleStateStore] = None,
+    ):
         self.host = host
         self.port = port
+        self.max_inflight = max_inflight
+        self.state = state or muscle_state
+        self.events = EventHub()
         self.resources: Dict[str, Callable[..., Awaitable[Any]]] = {}
         self.tools: Dict[str, Callable[..., Awaitable[Any]]] = {}
         self.chat_callback: Optional[Callable[[str], Awaitable[None]]] = None
+        # Loop of the connections subscribed to events, and the task watching the state for them
+        self._events_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._state_watcher: Optional[asyncio.Task] = None
         
         # Register resources and tools
         self._register_resources()
@@ -36,28 +65,57 @@ class MCPServer:
         """Set callback for sending messages to chat"""
         self.chat_callback = callback
     
-    async def fetch_parts(self) -> Dict[MuscleType, MuscleStatus]:
+    async def fetch_parts(self, since_version: Optional[int] = None) -> Dict[str, Any]:
         """
         Resource to fetch the status of all body muscles.
-        This is a placeholder and should be implemented later.
+        Returns {"version", "changed", "muscles"}; when since_version is given and the state is no
+        newer, "muscles" is left out so polling clients get a cheap no-change reply.
         """
-        # Placeholder - to be implemented
-        raise NotImplementedError("fetch_parts is not implemented yet")
+        return await self.state.fetch(since_version)
     
     async def update_status(self, muscles: Dict[MuscleType, MuscleStatus]) -> bool:
         """
         Tool to update the status of a list of body muscles.
-        This is a placeholder and should be implemented later.
+        The change is persisted to the body-state file before it becomes visible to fetch_parts,
+        then published to muscle_status subscribers as {"version", "changes"} (see _watch_state).
+        """
+        await self.state.update(muscles)
+        return True
+
+    def _watch_state(self) -> None:
+        """
+        Publish every change to the muscle state as a muscle_status event: writes through any server
+        sharing the state, and, while anyone is subscribed, writes by other processes, which are
+        picked up by reading the state every MUSCLE_STATE_RECHECK_S.
         """
-        # Placeholder - to be implemented
-        raise NotImplementedError("update_status is not implemented yet")
+        loop = asyncio.get_running_loop()
+        if self._events_loop is None:
+            self.state.add_listener(self._on_state_change)
+        self._events_loop = loop
+        if self._state_watcher is None or self._state_watcher.done():
+            self._state_watcher = loop.create_task(self._poll_state())
+
+    async def _poll_state(self) -> None:
+        while self.events.has_subscribers("muscle_status"):
+            await self.state.current()
+            await asyncio.sleep(MUSCLE_STATE_RECHECK_S)
+
+    def _on_state_change(self, snapshot: MuscleSnapshot, changes: Dict[str, str]) -> None:
+        # Called from whichever thread saw the change; the hub belongs to the event loop
+        try:
+            self._events_loop.call_soon_threadsafe(
+                self.events.publish, "muscle_status", {"version": snapshot.version, "changes": changes}
+            )
+        except RuntimeError:
+            # The loop the subscribers were served on has closed
+            pass
     
     async def send_stretches(self, muscle: MuscleType) -> bool:
         """
         Tool to send stretches for a specific part of the muscles.
         Sends a URL to the chat with stretch summaries and visual demonstrations.
         """
-        if not self.chat_callback:
+        if not self.chat_callback and not self.events.has_subscribers("chat_message"):
             return False
         
         muscle_codename = muscle.replace("-", "_")
@@ -92,11 +150,42 @@ class MCPServer:
 </div>
 """
         
-        await self.chat_callback(message)
+        if self.chat_callback:
+            await self.chat_callback(message)
+        self.events.publish("chat_message", {"muscle": muscle, "message": message})
         return True
     
-    async def handle_request(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Handle incoming requests and route them to appropriate handlers"""
+    async def handle_request(
+        self, request_data: Union[Dict[str, Any], List[Dict[str, Any]]]
+    ) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Handle incoming requests and route them to appropriate handlers.
+        A list of requests is a batch: its items run concurrently and the replies come back as a
+        list in the same order, each item failing on its own. Replies carry the request's "id".
+        """
+        if isinstance(request_data, list):
+            return await self._handle_batch(request_data)
+        response = await self._handle_single(request_data)
+        if isinstance(request_data, dict) and "id" in request_data:
+            response["id"] = request_data["id"]
+        return response
+    
+    async def _handle_batch(self, requests: List[Any]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        """Run the requests of a batch frame concurrently"""
+        if not requests:
+            return {"status": "error", "message": "Empty batch"}
+        if len(requests) > MAX_BATCH_SIZE:
+            return {"status": "error", "message": f"Batch of {len(requests)} requests exceeds {MAX_BATCH_SIZE}"}
+        
+        async def run_item(request: Any) -> Dict[str, Any]:
+            if not isinstance(request, dict):
+                return {"status": "error", "message": "Batch items must be request objects"}
+            return await self.handle_request(request)
+        
+        return list(await asyncio.gather(*(run_item(request) for request in requests)))
+    
+    async def _handle_single(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Route one request to its resource or tool handler"""
         try:
             request_type = request_data.get("type", "")
             action = request_data.get("action", "")
@@ -116,7 +205,7 @@ class MCPServer:
     async def start_server(self) -> None:
         """Start the MCP server"""
         server = await asyncio.start_server(
-            self._handle_client, self.host, self.port
+            self._handle_client, self.host, self.port, limit=MAX_FRAME_BYTES
         )
         
         async with server:
@@ -124,26 +213,167 @@ class MCPServer:
             await server.serve_forever()
     
     async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
-        """Handle client connection"""
+        """
+        Handle client connection.
+        Requests are pipelined: up to max_inflight run at once and each reply is written when its
+        request completes, carrying the request's "id". Replies to requests without an id keep their
+        request order. Once max_inflight requests are running the connection is not read further.
+        
+        {"type": "subscribe", "params": {"topics": [...], "queue_size": n, "overflow": policy}} makes the
+        connection receive {"event": topic, "data": ...} lines for those topics until it sends
+        {"type": "unsubscribe"} or disconnects. Events wait in a bounded queue; when a slow client lets
+        it fill up, the oldest event is dropped (muscle_status clients see a version gap and can
+        fetch_parts with since_version) or, with the "disconnect" policy, the connection is closed.
+        
+        Messages are newline-delimited JSON until the client sends
+        {"type": "negotiate", "params": {"framing": "length-prefixed", "codec": "msgpack"}}. Its reply
+        still uses the old format, sent once the requests already running have replied; every message
+        after it, both ways, is a 4-byte big-endian length followed by the encoded message.
+        """
         addr = writer.get_extra_info('peername')
         print(f"Connected by {addr}")
         
-        while True:
-            data = await reader.readline()
-            if not data:
-                break
-                
-            try:
-                request = json.loads(data.decode())
-                response = await self.handle_request(request)
-                writer.write(json.dumps(response).encode() + b'\n')
+        inflight = asyncio.Semaphore(self.max_inflight)
+        write_lock = asyncio.Lock()
+        tasks: set = set()
+        # Last pending request without an id; the next one's reply is written after it
+        previous_unordered: Optional[asyncio.Task] = None
+        subscriber: Optional[Subscriber] = None
+        event_sender: Optional[asyncio.Task] = None
+        framing = "line"
+        codec = CODECS["json"]
+        
+        def encode(message: Any) -> bytes:
+            payload = codec.encode(message)
+            return payload + b'\n' if framing == "line" else frame(payload)
+        
+        async def send(response: Union[Dict[str, Any], List[Dict[str, Any]]]) -> None:
+            async with write_lock:
+                writer.write(encode(response))
                 await writer.drain()
-            except json.JSONDecodeError:
-                writer.write(json.dumps({"status": "error", "message": "Invalid JSON"}).encode() + b'\n')
+        
+        async def read_message() -> Optional[bytes]:
+            """Next undecoded message, or None at end of stream. Raises ValueError past MAX_FRAME_BYTES."""
+            if framing == "line":
+                return await reader.readline() or None
+            return await read_frame(reader, MAX_FRAME_BYTES)
+        
+        async def negotiate(request: Dict[str, Any]) -> None:
+            nonlocal framing, codec
+            params = request.get("params", {})
+            new_framing = params.get("framing", "length-prefixed")
+            new_codec = params.get("codec", "json")
+            if new_framing not in FRAMINGS:
+                response = {"status": "error", "message": f"Unknown framing: {new_framing}; expected one of {', '.join(FRAMINGS)}"}
+            elif new_codec not in CODECS:
+                response = {"status": "error", "message": f"Unsupported codec: {new_codec}; this server offers {', '.join(CODECS)}"}
+            elif new_framing == "line" and new_codec != "json":
+                # Binary encodings can contain newlines
+                response = {"status": "error", "message": "Line framing only carries json"}
+            else:
+                response = {"status": "success", "data": {"framing": new_framing, "codec": new_codec}}
+            if "id" in request:
+                response["id"] = request["id"]
+            
+            # Replies to earlier requests still go out in the old format
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            async with write_lock:
+                writer.write(encode(response))
                 await writer.drain()
+                if response["status"] == "success":
+                    framing, codec = new_framing, CODECS[new_codec]
+        
+        async def send_events(events: Subscriber) -> None:
+            try:
+                async for event in events:
+                    await send(event)
+            except ConnectionError:
+                pass
+        
+        async def subscription(request: Dict[str, Any]) -> Dict[str, Any]:
+            nonlocal subscriber, event_sender
+            params = request.get("params", {})
+            try:
+                if request["type"] == "unsubscribe":
+                    if subscriber is not None:
+                        self.events.unsubscribe(subscriber, params.get("topics"))
+                    return {"status": "success", "data": {"topics": sorted(subscriber.topics) if subscriber else []}}
+                if subscriber is None:
+                    subscriber = Subscriber(
+                        params.get("queue_size", SUBSCRIBER_QUEUE_SIZE),
+                        params.get("overflow", SUBSCRIBER_OVERFLOW),
+                        # The event sender may be blocked in drain() on this very client, so drop it from here
+                        on_overflow=writer.transport.abort,
+                    )
+                    event_sender = asyncio.create_task(send_events(subscriber))
+                self.events.subscribe(subscriber, params.get("topics", TOPICS))
+                self._watch_state()
+                snapshot = await self.state.current()
+                return {"status": "success", "data": {"topics": sorted(subscriber.topics), "version": snapshot.version}}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+        
+        async def process(request: Any, wait_for: Optional[asyncio.Task]) -> None:
+            try:
+                if request is INVALID_JSON:
+                    response = {"status": "error", "message": f"Invalid {codec.label}"}
+                elif isinstance(request, dict) and request.get("type") in ("subscribe", "unsubscribe"):
+                    response = await subscription(request)
+                    if "id" in request:
+                        response["id"] = request["id"]
+                else:
+                    response = await self.handle_request(request)
+                if wait_for is not None:
+                    await asyncio.wait([wait_for])
+                await send(response)
+            except ConnectionError:
+                pass
+            finally:
+                inflight.release()
         
-        print(f"Disconnected from {addr}")
-        writer.close()
+        try:
+            while True:
+                try:
+                    data = await read_message()
+                except ValueError:
+                    # The message overran the frame limit; the rest of the stream cannot be framed
+                    await send({"status": "error", "message": "Request exceeds the frame size limit"})
+                    break
+                if data is None:
+                    break
+                
+                try:
+                    request = codec.decode(data)
+                except ValueError:
+                    request = INVALID_JSON
+                if isinstance(request, dict) and request.get("type") == "negotiate":
+                    await negotiate(request)
+                    continue
+                
+                await inflight.acquire()
+                
+                ordered = not (isinstance(request, dict) and "id" in request)
+                task = asyncio.create_task(process(request, previous_unordered if ordered else None))
+                if ordered:
+                    previous_unordered = task
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            
+            # Finish the requests still running before closing
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            if subscriber is not None:
+                self.events.unsubscribe(subscriber)
+                subscriber.close()
+                event_sender.cancel()
+            print(f"Disconnected from {addr}")
+            writer.close()
 
 async def example_chat_callback(message: str) -> None:
     """Example callback for sending messages to chat"""
@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional, get_args
+
+from openai.types import CompletionUsage
+from openai.types.completion_usage import PromptTokensDetails
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice
+from openai.types.chat.chat_completion_chunk import ChoiceDelta, ChoiceDeltaToolCall, ChoiceDeltaToolCallFunction
+from openai.types.chat.chat_completion_message_tool_call import Function
+
+from context import count_tokens, relevant_groups
+from mcp import MuscleType
+
+# Characters per streamed chunk, roughly one token
+MOCK_CHUNK_CHARS = 4
+# Words in a user message that point at a send_stretches muscle, besides the muscle names themselves
+MOCK_MUSCLE_WORDS = {
+    "calf": "calves", "shin": "calves", "thigh": "quads", "quad": "quads", "hamstring": "hamstrings",
+    "back": "lowerback", "shoulder": "front-shoulders", "neck": "traps", "wrist": "forearms",
+    "hand": "hands", "bicep": "biceps", "tricep": "triceps", "glute": "glutes", "hip": "glutes",
+    "stomach": "abdominals", "abs": "abdominals", "side": "obliques",
+}
+# Provider prompt caching: prefixes shorter than this are never cached, longer hits count in steps of
+# PROMPT_CACHE_STEP tokens
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_STEP = 128
+
+class MockResponse:
+    """One scripted reply: text content and/or tool calls given as (name, arguments dict) pairs"""
+    def __init__(self, content: Optional[str] = None, tool_calls: Optional[List[tuple]] = None):
+        self.content = content
+        self.tool_calls = tool_calls or []
+
+class MockStream:
+    """Async iterator of ChatCompletionChunk objects, like the SDK's AsyncStream"""
+    def __init__(self, chunks: AsyncIterator[ChatCompletionChunk]):
+        self._chunks = chunks
+
+    def __aiter__(self) -> AsyncIterator[ChatCompletionChunk]:
+        return self._chunks
+
+class MockOpenAI:
+    """
+    Offline stand-in for AsyncOpenAI: `client.chat.completions.create` returns ChatCompletion objects,
+    or a stream of ChatCompletionChunk objects with stream=True, after a simulated latency.
+
+    Replies come from `recordings` when one matches, otherwise they are synthesized from the request:
+    JSON mode returns an update for the body-state groups the user mentions, chat mode answers a
+    message naming a muscle with a send_stretches call only (the common gpt-4o reply that needs a
+    follow-up), and a follow-up after tool results is plain text.
+
+    Usage reports cached prompt tokens like the provider's prompt cache: the longest run of leading
+    messages an earlier request to the same model (with the same tools) already sent.
+
+    A recording is a dict with a "match" regex tested against the user input, an optional "mode"
+    ("json" or "chat"), and the reply as "content" and/or "tool_calls" ([{"name", "arguments"}]).
+    """
+    def __init__(
+        self,
+        first_token_ms: float = 300.0,
+        token_ms: float = 15.0,
+        jitter: float = 0.2,
+        recordings: Optional[List[Dict[str, Any]]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.jitter = jitter
+        self.recordings = recordings or []
+        self.calls = 0
+        # Digests of every message prefix sent so far, for the cached-token count
+        self._prompt_prefixes = set()
+        self._random = random.Random(seed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @classmethod
+    def from_env(cls) -> "MockOpenAI":
+        """Configure from PHIZZY_MOCK_LLM_* environment variables"""
+        recordings = None
+        recordings_path = os.getenv("PHIZZY_MOCK_LLM_RECORDINGS")
+        if recordings_path:
+            with open(recordings_path) as f:
+                recordings = json.load(f)
+        return cls(
+            first_token_ms=float(os.getenv("PHIZZY_MOCK_LLM_FIRST_TOKEN_MS", "300")),
+            token_ms=float(os.getenv("PHIZZY_MOCK_LLM_TOKEN_MS", "15")),
+            jitter=float(os.getenv("PHIZZY_MOCK_LLM_JITTER", "0.2")),
+            recordings=recordings,
+        )
+
+    async def _delay(self, ms: float) -> None:
+        await asyncio.sleep(max(ms * (1 + self._random.uniform(-self.jitter, self.jitter)), 0) / 1000)
+
+    async def create(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        stream: bool = False,
+        stream_options: Optional[Dict[str, Any]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        tool_choice: Optional[str] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ):
+        self.calls += 1
+        json_mode = (response_format or {}).get("type") == "json_object"
+        reply = self._reply(messages, json_mode)
+        if not tools or tool_choice == "none":
+            reply = MockResponse(reply.content or "Let me know if those stretches help.")
+        usage = CompletionUsage(
+            prompt_tokens=sum(count_tokens(str(message.get("content") or "")) for message in messages),
+            completion_tokens=count_tokens(reply.content or "") + 10 * len(reply.tool_calls),
+            total_tokens=0,
+            prompt_tokens_details=PromptTokensDetails(cached_tokens=self._cached_tokens(model, messages, tools)),
+        )
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        if stream:
+            include_usage = bool((stream_options or {}).get("include_usage"))
+            return MockStream(self._stream(model, reply, usage if include_usage else None))
+
+        chunks = len(reply.content or "") // MOCK_CHUNK_CHARS + 1
+        await self._delay(self.first_token_ms + chunks * self.token_ms)
+        message = ChatCompletionMessage(
+            role="assistant",
+            content=reply.content,
+            tool_calls=[
+                ChatCompletionMessageToolCall(id=f"call_{uuid.uuid4().hex[:12]}", type="function", function=Function(name=name, arguments=json.dumps(arguments)))
+                for name, arguments in reply.tool_calls
+            ] or None,
+        )
+        return ChatCompletion(
+            id=f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            choices=[Choice(index=0, finish_reason="tool_calls" if reply.tool_calls else "stop", message=message)],
+            created=int(time.time()),
+            model=model,
+            object="chat.completion",
+            usage=usage,
+        )
+
+    async def _stream(self, model: str, reply: MockResponse, usage: Optional[CompletionUsage]) -> AsyncIterator[ChatCompletionChunk]:
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+
+        def chunk(delta: ChoiceDelta, finish_reason: Optional[str] = None) -> ChatCompletionChunk:
+            return ChatCompletionChunk(
+                id=completion_id,
+                choices=[ChunkChoice(index=0, delta=delta, finish_reason=finish_reason)],
+                created=int(time.time()),
+                model=model,
+                object="chat.completion.chunk",
+            )
+
+        await self._delay(self.first_token_ms)
+        content = reply.content or ""
+        for start in range(0, len(content), MOCK_CHUNK_CHARS):
+            if start:
+                await self._delay(self.token_ms)
+            yield chunk(ChoiceDelta(content=content[start:start + MOCK_CHUNK_CHARS]))
+        for index, (name, arguments) in enumerate(reply.tool_calls):
+            call_id = f"call_{uuid.uuid4().hex[:12]}"
+            yield chunk(ChoiceDelta(tool_calls=[ChoiceDeltaToolCall(
+                index=index, id=call_id, type="function", function=ChoiceDeltaToolCallFunction(name=name, arguments=""),
+            )]))
+            raw = json.dumps(arguments)
+            for start in range(0, len(raw), MOCK_CHUNK_CHARS):
+                await self._delay(self.token_ms)
+                yield chunk(ChoiceDelta(tool_calls=[ChoiceDeltaToolCall(
+                    index=index, function=ChoiceDeltaToolCallFunction(arguments=raw[start:start + MOCK_CHUNK_CHARS]),
+                )]))
+        yield chunk(ChoiceDelta(), "tool_calls" if reply.tool_calls else "stop")
+        if usage is not None:
+            yield ChatCompletionChunk(
+                id=completion_id, choices=[], created=int(time.time()), model=model,
+                object="chat.completion.chunk", usage=usage,
+            )
+
+    def _cached_tokens(self, model: str, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]]) -> int:
+        """Prompt tokens a provider prompt cache would serve for this request, remembering its prefixes"""
+        digest = hashlib.sha256(json.dumps([model, tools], default=str).encode())
+        cached = tokens = 0
+        for message in messages:
+            digest.update(json.dumps(message, default=str, sort_keys=True).encode())
+            tokens += count_tokens(str(message.get("content") or ""))
+            # The digest covers every message so far, so a hit means the whole prefix matched
+            key = digest.copy().hexdigest()
+            if key in self._prompt_prefixes:
+                cached = tokens
+            self._prompt_prefixes.add(key)
+        if cached < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return cached // PROMPT_CACHE_STEP * PROMPT_CACHE_STEP
+
+    def _reply(self, messages: List[Dict[str, Any]], json_mode: bool) -> MockResponse:
+        """Pick a recorded reply for the request or synthesize one"""
+        if messages and messages[-1].get("role") == "tool":
+            return MockResponse("I've sent some stretches that should help. Hold each one for about 30 seconds and stop if the pain gets sharper.")
+
+        last_user = next((m for m in reversed(messages) if m.get("role") == "user"), {})
+        prompt = str(last_user.get("content") or "")
+        body_data: Dict[str, Any] = {}
+        user_input = prompt
+        if prompt.startswith("preexisting json file structure: ") and "\n\nUser Input: " in prompt:
+            body_json, user_input = prompt[len("preexisting json file structure: "):].split("\n\nUser Input: ", 1)
+            try:
+                body_data = json.loads(body_json)
+            except json.JSONDecodeError:
+                body_data = {}
+
+        mode = "json" if json_mode else "chat"
+        for recording in self.recordings:
+            if recording.get("mode", mode) == mode and re.search(recording.get("match", ""), user_input, re.IGNORECASE):
+                content = recording.get("content")
+                if isinstance(content, (dict, list)):
+                    content = json.dumps(content)
+                tool_calls = [(call["name"], call.get("arguments", {})) for call in recording.get("tool_calls", [])]
+                return MockResponse(content, tool_calls)
+
+        muscles = _mentioned_muscles(user_input)
+        tool_calls = [("send_stretches", {"muscle": muscle}) for muscle in muscles]
+        if json_mode:
+            update = {
+                group: {
+                    "pain_level": "5",
+                    "pain_points": ["soreness"],
+                    "exercises": ["gentle stretching"],
+                    "warnings": ["Seek medical attention if the pain gets worse."],
+                }
+                for group in sorted(relevant_groups(body_data, [user_input]))
+            }
+            update["actual query response"] = [
+                "That sounds like muscle soreness from overuse.",
+                "Gentle stretching and rest should help over the next few days.",
+            ]
+            return MockResponse(json.dumps(update), tool_calls)
+        if tool_calls:
+            return MockResponse(None, tool_calls)
+        return MockResponse("Could you tell me more about where it hurts and what makes it worse?")
+
+def _mentioned_muscles(text: str) -> List[str]:
+    """send_stretches muscles named in text, in MuscleType order"""
+    words = set(re.findall(r"[a-z]+(?:-[a-z]+)?", text.lower()))
+    stems = {word.rstrip("s") for word in words}
+    found = {MOCK_MUSCLE_WORDS[stem] for stem in stems if stem in MOCK_MUSCLE_WORDS}
+    found |= {muscle for muscle in get_args(MuscleType) if muscle in words}
+    return [muscle for muscle in dict.fromkeys(get_args(MuscleType)) if muscle in found]
@@ -0,0 +1,21 @@
+# Define a dictionary mapping HEX colors to muscle group names (from colors.txt)
+MUSCLE_GROUPS = {
+    'ffff00': 'right trap',
+    '00ff00': 'right shoulder',
+    'ff00ff': 'right chest',
+    '0000ff': 'right bicep',
+    'ff0000': 'right forearm',
+    '00fff8': 'right oblique',
+    '2b3d29': 'left trap',
+    'b7ace8': 'left shoulder',
+    '4b5849': 'left chest',
+    '8425d8': 'left bicep',
+    '907389': 'left forearm',
+    'bf93e6': 'left oblique',
+    '67ff00': 'abs',
+    'ff00aa': 'groin',
+    'ff7000': 'right thigh',
+    '816e92': 'left thigh',
+    '67a095': 'right calf',
+    'c3eca7': 'left calf',
+}
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from body_store import DEFAULT_USER_ID, body_store
+
+# Side document (see body_store) the muscle statuses are persisted under, apart from the body state
+MUSCLE_STATUS_KEY = "muscle_status"
+# Seconds a snapshot is served without asking the store whether another process changed it
+MUSCLE_STATE_RECHECK_S = float(os.getenv("PHIZZY_MUSCLE_STATE_RECHECK_S", "0.5"))
+
+class MuscleSnapshot:
+    """Muscle statuses at one version. Shared between readers, so treat muscles as read-only."""
+    def __init__(self, version: int, muscles: Dict[str, str], token: Hashable = None):
+        self.version = version
+        self.muscles = muscles
+        # Store change token the snapshot was loaded at; None forces a reload on the next read
+        self.token = token
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any], token: Hashable = None) -> "MuscleSnapshot":
+        return cls(document.get("version", 0), dict(document.get("muscles", {})), token)
+
+class MuscleStateStore:
+    """
+    In-memory MuscleType -> MuscleStatus map for the MCP server.
+    Reads are dict lookups on the current snapshot; the store's change token is checked at most
+    every MUSCLE_STATE_RECHECK_S and the snapshot reloaded only when it moved. Every write that
+    changes something builds a new snapshot with the next version, persisted before it becomes
+    visible. Other processes (the Streamlit app and a standalone MCP server) share the stored
+    document: each write starts from the stored version, so their writes neither overwrite each
+    other nor reuse version numbers. Listeners hear about every change, whether written here or
+    loaded after another process wrote it.
+    """
+    def __init__(
+        self,
+        valid_muscles: Iterable[str],
+        valid_statuses: Iterable[str],
+        user_id: str = DEFAULT_USER_ID,
+        store=body_store,
+    ):
+        self.valid_muscles = set(valid_muscles)
+        self.valid_statuses = list(dict.fromkeys(valid_statuses))
+        self.user_id = user_id
+        self.store = store
+        self._snapshot: Optional[MuscleSnapshot] = None
+        # time.monotonic() of the last change token check
+        self._checked_at = 0.0
+        self._load_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._listeners: List[Callable[[MuscleSnapshot, Dict[str, str]], None]] = []
+
+    def add_listener(self, listener: Callable[[MuscleSnapshot, Dict[str, str]], None]) -> None:
+        """
+        Call listener(snapshot, changes) after every change. It runs on the thread that saw the change,
+        usually a worker thread, and must not block. A reload that skipped versions reports the net changes.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[MuscleSnapshot, Dict[str, str]], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify_since(self, previous: MuscleSnapshot, snapshot: MuscleSnapshot) -> None:
+        """Tell the listeners what changed between two snapshots, if snapshot is newer"""
+        if snapshot.version <= previous.version:
+            return
+        changes = {muscle: status for muscle, status in snapshot.muscles.items() if previous.muscles.get(muscle) != status}
+        if changes:
+            for listener in list(self._listeners):
+                listener(snapshot, changes)
+
+    def _is_fresh(self) -> bool:
+        return self._snapshot is not None and time.monotonic() - self._checked_at < MUSCLE_STATE_RECHECK_S
+
+    async def current(self) -> MuscleSnapshot:
+        """snapshot() for the event loop: store queries (and the first load's migration) run in a worker thread"""
+        if self._is_fresh():
+            return self._snapshot
+        return await asyncio.to_thread(self.snapshot)
+
+    def snapshot(self) -> MuscleSnapshot:
+        """Current snapshot, reloaded when the stored document changed (e.g. written by another process). Blocks."""
+        if self._is_fresh():
+            return self._snapshot
+        checked_at = time.monotonic()
+        token = self.store.document_change_token(MUSCLE_STATUS_KEY, self.user_id)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.token == token:
+            self._checked_at = checked_at
+            return snapshot
+        with self._load_lock:
+            if self._snapshot is None:
+                self._migrate_body_state_entry()
+                token = self.store.document_change_token(MUSCLE_STATUS_KEY, self.user_id)
+            loaded = MuscleSnapshot.from_document(self.store.read_document(MUSCLE_STATUS_KEY, self.user_id), token)
+            previous = self._snapshot
+            if previous is None or loaded.version >= previous.version:
+                self._snapshot = loaded
+            self._checked_at = checked_at
+            if previous is not None:
+                # Written by another process (or another store on the same document)
+                self._notify_since(previous, loaded)
+            return self._snapshot
+
+    def _migrate_body_state_entry(self) -> None:
+        """Move statuses saved as a fake muscle group in the body state into their own document"""
+        if MUSCLE_STATUS_KEY not in self.store.read(self.user_id):
+            return
+        with self.store.transaction(self.user_id) as body_data:
+            legacy = body_data.pop(MUSCLE_STATUS_KEY, None)
+        if isinstance(legacy, dict):
+            with self.store.document_transaction(MUSCLE_STATUS_KEY, self.user_id) as document:
+                if not document:
+                    document.update(legacy)
+
+    def get(self, muscle: str) -> Optional[str]:
+        """Status of one muscle, or None if it was never set. Blocks; use current() on the event loop."""
+        return self.snapshot().muscles.get(muscle)
+
+    async def update(self, muscles: Dict[str, str]) -> Tuple[MuscleSnapshot, Dict[str, str]]:
+        """Apply status changes; returns the resulting snapshot and the statuses that actually changed"""
+        unknown = [muscle for muscle in muscles if muscle not in self.valid_muscles]
+        if unknown:
+            raise ValueError(f"Unknown muscles: {', '.join(map(str, unknown))}")
+        invalid = {muscle: status for muscle, status in muscles.items() if status not in self.valid_statuses}
+        if invalid:
+            raise ValueError(f"Invalid statuses: {invalid}; expected one of {', '.join(self.valid_statuses)}")
+
+        # The file write blocks, so the whole write runs in a worker thread
+        return await asyncio.to_thread(self._apply, muscles)
+
+    def _apply(self, muscles: Dict[str, str]) -> Tuple[MuscleSnapshot, Dict[str, str]]:
+        self.snapshot()
+        with self._write_lock:
+            previous = self._snapshot
+            with self.store.document_transaction(MUSCLE_STATUS_KEY, self.user_id) as document:
+                # Build on the stored version, which another process may have moved past ours
+                current = MuscleSnapshot.from_document(document)
+                changes = {muscle: status for muscle, status in muscles.items() if current.muscles.get(muscle) != status}
+                snapshot = current
+                if changes:
+                    snapshot = MuscleSnapshot(current.version + 1, {**current.muscles, **changes})
+                    document.update({"version": snapshot.version, "muscles": snapshot.muscles})
+            # Published only once committed, so readers never see a version the store does not have
+            self._snapshot = snapshot
+            # Includes changes other processes made since our last read, which this write builds on
+            self._notify_since(previous, snapshot)
+            return snapshot, changes
+
+    async def fetch(self, since_version: Optional[int] = None) -> Dict[str, Any]:
+        """Statuses with their version; only the version when since_version is already current"""
+        snapshot = await self.current()
+        if since_version is not None and snapshot.version <= since_version:
+            return {"version": snapshot.version, "changed": False}
+        return {"version": snapshot.version, "changed": True, "muscles": snapshot.muscles}
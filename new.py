@@ -1,23 +1,16 @@
 import streamlit as st
-from tools import generate_chat_analysis, get_audio_input
-import asyncio
-import os
-import json
+from tools import generate_chat_analysis, collect_chat_messages, get_audio_input
+from body_store import body_store
+from user_session import session_user_id
+from event_loop import run_async
 
 def chatbot():
-    # Load body.json
-    json_path = "body.json"
-    if os.path.exists(json_path):
-        with open(json_path, "r") as f:
-            try:
-                body_data = json.load(f)
-            except json.JSONDecodeError:
-                body_data = {}
-    else:
-        body_data = {}
+    # Load this user's body state
+    body_state = body_store.snapshot(session_user_id())
+    body_data = body_state.data
     
-    # Convert to string for passing to the LLM
-    body_json = json.dumps(body_data)
+    # String for passing to the LLM, serialized once per body-state version
+    body_json = body_state.prompt_json
     
     chatbox = st.container(height=800)
     prompt = st.text_input("Text Query:")
@@ -25,24 +18,15 @@ def chatbot():
         with chatbox.chat_message("user"):
             st.markdown(prompt)
         with st.spinner("Analyzing your input..."):
-            response = asyncio.run(generate_chat_analysis(prompt, body_json=body_json))
+            with collect_chat_messages():
+                response = run_async(generate_chat_analysis(prompt, body_json=body_json))
             try:
                 # If response is a tuple (meaning it contains the display_text and JSON data)
                 if isinstance(response, tuple) and len(response) == 2:
                     actual_response, response_json = response
                     
-                    # Update existing JSON data with new info from response
-                    for muscle_group, info in response_json.items():
-                        if muscle_group in body_data:
-                            # Update existing muscle group data
-                            body_data[muscle_group].update(info)
-                        else:
-                            # Add new muscle group data
-                            body_data[muscle_group] = info
-                    
-                    # Save the updated JSON to file
-                    with open(json_path, "w") as f:
-                        json.dump(body_data, f, indent=2)
+                    # Upsert the new info into this user's body state
+                    body_data = body_store.merge(response_json, session_user_id())
                 else:
                     actual_response = response
                     
@@ -59,24 +43,15 @@ def chatbot():
             with chatbox.chat_message("user"):
                 st.markdown(prompt)
             with st.spinner("Analyzing your input..."):
-                response = asyncio.run(generate_chat_analysis(prompt, body_json=body_json))
+                with collect_chat_messages():
+                    response = run_async(generate_chat_analysis(prompt, body_json=body_json))
                 try:
                     # If response is a tuple (meaning it contains the display_text and JSON data)
                     if isinstance(response, tuple) and len(response) == 2:
                         actual_response, response_json = response
                         
-                        # Update existing JSON data with new info from response
-                        for muscle_group, info in response_json.items():
-                            if muscle_group in body_data:
-                                # Update existing muscle group data
-                                body_data[muscle_group].update(info)
-                            else:
-                                # Add new muscle group data
-                                body_data[muscle_group] = info
-                        
-                        # Save the updated JSON to file
-                        with open(json_path, "w") as f:
-                            json.dump(body_data, f, indent=2)
+                        # Upsert the new info into this user's body state
+                        body_data = body_store.merge(response_json, session_user_id())
                     else:
                         actual_response = response
                         
@@ -0,0 +1,102 @@
+import asyncio
+import os
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional, Set
+
+# Topics clients can subscribe to
+TOPICS = ("muscle_status", "chat_message")
+# Events a subscriber may have queued before the overflow policy applies
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("PHIZZY_MCP_SUBSCRIBER_QUEUE", "256"))
+# "drop_oldest" discards the oldest queued event, "disconnect" drops the subscriber
+SUBSCRIBER_OVERFLOW = os.getenv("PHIZZY_MCP_SUBSCRIBER_OVERFLOW", "drop_oldest")
+OVERFLOW_POLICIES = ("drop_oldest", "disconnect")
+
+_CLOSED = object()
+
+class Subscriber:
+    """
+    One subscriber's bounded event queue. Iterate it with `async for event in subscriber` until it
+    is closed, either by unsubscribing or by overflowing under the "disconnect" policy.
+    on_overflow runs when the "disconnect" policy closes the subscriber; the consumer may be stuck
+    writing to a stalled client, so this is where its connection should be dropped.
+    """
+    def __init__(
+        self,
+        queue_size: int = SUBSCRIBER_QUEUE_SIZE,
+        overflow: str = SUBSCRIBER_OVERFLOW,
+        on_overflow: Optional[Callable[[], None]] = None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}; expected one of {', '.join(OVERFLOW_POLICIES)}")
+        self.topics: Set[str] = set()
+        self.overflow = overflow
+        self.queue: asyncio.Queue = asyncio.Queue(max(queue_size, 1))
+        self.dropped = 0
+        self.closed = False
+        # Set when the "disconnect" policy closed the subscriber
+        self.overflowed = False
+        self.on_overflow = on_overflow
+
+    def offer(self, event: Dict[str, Any]) -> None:
+        """Queue an event without waiting, applying the overflow policy when the queue is full"""
+        if self.closed:
+            return
+        if self.queue.full():
+            if self.overflow == "disconnect":
+                self.overflowed = True
+                self.close()
+                if self.on_overflow:
+                    self.on_overflow()
+                return
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        # Make room for the end marker so a waiting consumer wakes up
+        while self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        while True:
+            event = await self.queue.get()
+            if event is _CLOSED:
+                return
+            yield event
+
+class EventHub:
+    """Fans published events out to the subscribers of their topic. Use from the event loop thread."""
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscriber]] = {topic: set() for topic in TOPICS}
+
+    def subscribe(self, subscriber: Subscriber, topics: Iterable[str]) -> None:
+        topics = list(topics)
+        unknown = [topic for topic in topics if topic not in self._subscribers]
+        if unknown:
+            raise ValueError(f"Unknown topics: {', '.join(map(str, unknown))}; expected some of {', '.join(TOPICS)}")
+        for topic in topics:
+            self._subscribers[topic].add(subscriber)
+            subscriber.topics.add(topic)
+
+    def unsubscribe(self, subscriber: Subscriber, topics: Optional[Iterable[str]] = None) -> None:
+        """Remove subscriber from topics (all of its topics by default)"""
+        for topic in list(subscriber.topics if topics is None else topics):
+            self._subscribers.get(topic, set()).discard(subscriber)
+            subscriber.topics.discard(topic)
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self._subscribers.get(topic))
+
+    def publish(self, topic: str, data: Dict[str, Any]) -> None:
+        """Queue {"event": topic, "data": data} for every subscriber of topic"""
+        subscribers = self._subscribers.get(topic)
+        if not subscribers:
+            return
+        event = {"event": topic, "data": data}
+        for subscriber in list(subscribers):
+            subscriber.offer(event)
+            if subscriber.closed:
+                self.unsubscribe(subscriber)
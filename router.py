@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from intent import find_muscles, match_stretch_intent
+
+logger = logging.getLogger(__name__)
+
+# Set PHIZZY_ROUTER=0 to send every turn to the full model
+ROUTER_ENABLED = os.getenv("PHIZZY_ROUTER", "1") != "0"
+FULL_MODEL = os.getenv("PHIZZY_FULL_MODEL", "gpt-4o")
+FAST_MODEL = os.getenv("PHIZZY_FAST_MODEL", "gpt-4o-mini")
+# Assumed full-model turn latency until one has been measured
+ROUTE_FULL_LATENCY_MS = float(os.getenv("PHIZZY_ROUTE_FULL_LATENCY_MS", "2500"))
+# USD per million (prompt, completion) tokens
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    **json.loads(os.getenv("PHIZZY_MODEL_PRICES", "{}")),
+}
+
+# Terms that keep a turn away from the direct send_stretches route
+SYMPTOM_TERMS = {
+    "pain", "painful", "hurt", "hurts", "hurting", "ache", "aches", "aching", "sore", "soreness",
+    "sharp", "stabbing", "shooting", "burning", "numb", "numbness", "tingling", "swelling", "swollen",
+    "bruise", "bruised", "injury", "injured", "sprain", "sprained", "strain", "strained", "tear", "torn",
+    "pop", "popped", "stiff", "stiffness", "tight", "cramp", "cramps", "weak", "weakness", "dizzy",
+    "worse", "worried", "serious", "doctor", "weeks", "months", "since",
+}
+
+# Acknowledgements and greetings; only turns made up entirely of these words go to the fast model
+TRIVIAL_TURN_WORDS = {
+    "thanks", "thank", "thx", "ty", "cheers", "ok", "okay", "k", "cool", "great", "nice", "perfect", "awesome",
+    "alright", "hi", "hello", "hey", "bye", "goodbye", "good", "morning", "afternoon", "evening", "night",
+    "you", "so", "much", "a", "lot", "that", "this", "helps", "helped", "helpful", "got", "it", "sounds",
+    "see", "later", "will", "do", "again", "very", "there",
+}
+
+class Route:
+    """Where one turn goes: "direct" (send_stretches for muscles, no model), "fast" or "full" model"""
+    def __init__(self, name: str, model: Optional[str], reason: str, muscles: Optional[List[str]] = None):
+        self.name = name
+        self.model = model
+        self.reason = reason
+        self.muscles = muscles or []
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z]+(?:-[a-z]+)?", text.lower())
+
+def turn_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> float:
+    """USD cost of a completion's tokens on model"""
+    if model is None:
+        return 0.0
+    prompt_price, completion_price = MODEL_PRICES.get(model, MODEL_PRICES[FULL_MODEL])
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+class ModelRouter:
+    """
+    Classifies each turn with a local heuristic: confident stretch requests (see intent.py) go straight
+    to send_stretches, pure acknowledgements and greetings that name no body part go to the fast model,
+    everything else (symptom analysis) to the full model. The fast route is an allow-list, so any turn
+    the heuristic does not recognise fails closed to the full model.
+    Logs each turn's latency and cost against the full model; stats() holds the running totals.
+    """
+    def __init__(self, enabled: bool = ROUTER_ENABLED):
+        self.enabled = enabled
+        self.turns: Dict[str, int] = {}
+        self.saved_ms = 0.0
+        self.saved_cost = 0.0
+        self._full_latency_ms = ROUTE_FULL_LATENCY_MS
+        self._full_turns = 0
+        self._full_cost = 0.0
+
+    def route(self, user_input: str) -> Route:
+        """Pick the route for one user message"""
+        if not self.enabled:
+            return Route("full", FULL_MODEL, "router disabled")
+        words = _words(user_input)
+        symptoms = SYMPTOM_TERMS.intersection(words)
+        if symptoms:
+            return Route("full", FULL_MODEL, f"symptom terms: {', '.join(sorted(symptoms))}")
+        intent = match_stretch_intent(user_input)
+        if intent:
+            return Route("direct", None, f"stretch request, {intent.confidence:.0%} matched", intent.muscles)
+        muscles, _ = find_muscles(re.findall(r"[a-z]+", user_input.lower()))
+        if muscles:
+            return Route("full", FULL_MODEL, f"names {', '.join(muscles)}")
+        if words and TRIVIAL_TURN_WORDS.issuperset(words):
+            return Route("fast", FAST_MODEL, "acknowledgement or greeting")
+        return Route("full", FULL_MODEL, f"{len(words)} words")
+
+    def record(self, route: Route, latency_ms: float, usage: Dict[str, int]) -> None:
+        """Log a finished turn with its latency and cost savings against the full model"""
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        cost = turn_cost(route.model, prompt_tokens, completion_tokens)
+        self.turns[route.name] = self.turns.get(route.name, 0) + 1
+        if route.name == "full":
+            # Running means of full-model turns are the baseline for the other routes
+            self._full_turns += 1
+            self._full_latency_ms += (latency_ms - self._full_latency_ms) / self._full_turns
+            self._full_cost += (cost - self._full_cost) / self._full_turns
+            saved_ms = saved_cost = 0.0
+        else:
+            saved_ms = max(self._full_latency_ms - latency_ms, 0.0)
+            if route.model is None:
+                full_cost = self._full_cost
+            else:
+                full_cost = turn_cost(FULL_MODEL, prompt_tokens, completion_tokens)
+            saved_cost = max(full_cost - cost, 0.0)
+        self.saved_ms += saved_ms
+        self.saved_cost += saved_cost
+        logger.debug(
+            "Route %s (%s; %s): %.0fms, $%.5f, saved ~%.0fms and $%.5f",
+            route.name, route.model or "no model", route.reason, latency_ms, cost, saved_ms, saved_cost,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "turns": dict(self.turns),
+            "saved_ms": self.saved_ms,
+            "saved_cost": self.saved_cost,
+            "full_latency_ms": self._full_latency_ms,
+        }
+
+model_router = ModelRouter()
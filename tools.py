@@ -1,29 +1,430 @@
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
+import httpx
 import os
 import speech_recognition as sr
 import streamlit as st
 import json
-from typing import Dict, Any, List, Optional, Tuple, Union
+import logging
+import time
+import copy
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple, Union
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
 from mcp import MCPServer, MuscleType
+from context import build_context
+from router import Route, model_router
+from json_stream import JsonFieldStreamer
 import asyncio
 
 load_dotenv()
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+logger = logging.getLogger(__name__)
+
+# Connection pool of the shared OpenAI client; connections are kept alive and reused across
+# messages and sessions because every request runs on the one background event loop
+OPENAI_MAX_CONNECTIONS = int(os.getenv("PHIZZY_OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PHIZZY_OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("PHIZZY_OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_TIMEOUT = float(os.getenv("PHIZZY_OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("PHIZZY_OPENAI_CONNECT_TIMEOUT", "5"))
+
+http_client = DefaultAsyncHttpxClient(
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    ),
+    timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+)
+if os.getenv("PHIZZY_MOCK_LLM"):
+    # Offline stand-in for load tests and local development (see mock_llm.py)
+    from mock_llm import MockOpenAI
+    client = MockOpenAI.from_env()
+else:
+    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
 mcp_server = MCPServer()
 
+# Chat messages sent by MCP tools during the current request. Requests run on the background
+# event loop, where st.session_state is not available, so they are collected here instead.
+chat_outbox: ContextVar[Optional[List[str]]] = ContextVar("chat_outbox", default=None)
+
 async def chat_callback(message: str) -> None:
     """Send message to chat - will be captured by the Streamlit app"""
+    outbox = chat_outbox.get()
+    if outbox is not None:
+        outbox.append(message)
+        return
     st.session_state.setdefault("mcp_messages", [])
     st.session_state.mcp_messages.append(message)
 
+@contextmanager
+def collect_chat_messages() -> Iterator[List[str]]:
+    """
+    Collect MCP chat messages from requests submitted to the background loop inside this block,
+    then hand them to the Streamlit app through st.session_state.mcp_messages.
+    """
+    outbox: List[str] = []
+    token = chat_outbox.set(outbox)
+    try:
+        yield outbox
+    finally:
+        chat_outbox.reset(token)
+        st.session_state.setdefault("mcp_messages", [])
+        st.session_state.mcp_messages.extend(outbox)
+
 # Set up the MCP server's chat callback
 mcp_server.set_chat_callback(chat_callback)
 
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "send_stretches",
+            "description": "Send specific stretches for a muscle group",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "muscle": {
+                        "type": "string",
+                        "enum": [
+                            "hands", "forearms", "biceps", "front-shoulders", "chest", 
+                            "obliques", "abdominals", "quads", "calves", "triceps", 
+                            "rear-shoulders", "traps", "traps-middle", "lats", 
+                            "lowerback", "hamstrings", "glutes", "calves"
+                        ],
+                        "description": "The specific muscle group to get stretches for"
+                    }
+                },
+                "required": ["muscle"]
+            }
+        }
+    }
+]
+
+FALLBACK_TOOL_RESULT = "Tools processed successfully. Stretches have been sent to the user."
+ERROR_RESPONSE = "I'm sorry, there was an error processing your request. Please try again."
+NO_CONTENT_RESPONSE = "I've analyzed your input and sent appropriate resources. Is there anything specific you'd like to know more about?"
+
+# How chat mode finishes a turn whose reply is tool calls only: "model" sends the local tool results
+# back for a follow-up completion, "attach" answers from the tool results without a second model call
+TOOL_FOLLOWUP_MODE = os.getenv("PHIZZY_TOOL_FOLLOWUP", "model")
+# Follow-up completions allowed per chat turn while the model keeps answering with tool calls only
+MAX_TOOL_FOLLOWUPS = int(os.getenv("PHIZZY_MAX_TOOL_FOLLOWUPS", "1"))
+
+# System prompts are byte-stable (no per-request data) so the provider can cache the prompt prefix:
+# tool schema, then instructions, then history; the body state and user input go in the last message.
+CHAT_SYSTEM_MESSAGE = (
+    "You are PhizzyAI, an advanced AI physical therapist. Your role is to analyze user-reported "
+    "pain, discomfort, or physical issues and provide detailed, empathetic, and actionable advice. "
+    "You are highly knowledgeable in anatomy, physical therapy techniques, and rehabilitation exercises. "
+    "When a user describes their symptoms, you will:\n"
+    "1. Identify the potential cause of the issue based on the symptoms described.\n"
+    "2. Suggest specific stretches, exercises, or techniques to alleviate the pain or discomfort.\n"
+    "3. Provide clear warnings if the symptoms described could indicate a serious condition that requires "
+    "immediate medical attention.\n"
+    "4. Always communicate in a professional, empathetic, and easy-to-understand manner.\n\n"
+    "You have access to the following tools:\n"
+    "- send_stretches: Send specific stretches for a muscle group\n"
+    "  Parameters: muscle (string) - one of: hands, forearms, biceps, front-shoulders, chest, obliques, abdominals, "
+    "quads, calves, triceps, rear-shoulders, traps, traps-middle, lats, lowerback, hamstrings, glutes, calves\n\n"
+    "Your response should include:\n"
+    "- A brief analysis of the symptoms.\n"
+    "- Suggested actions or exercises.\n"
+    "- Any necessary warnings or advice to seek medical attention if applicable.\n"
+    "If you recommend stretches for specific muscles, use the send_stretches tool to provide links."
+)
+
+# JSON mode shares the chat prompt as its prefix and adds the body.json update instructions
+JSON_SYSTEM_MESSAGE = CHAT_SYSTEM_MESSAGE + (
+    "\n\n"
+    "The last user message starts with the preexisting json file structure, followed by the User Input.\n"
+    "Create a JSON object with the following structure:\n"
+    "{\n"
+    "    \"muscle_group_name\": {\n"
+    "        \"pain_points\": [\"symptom1\", \"symptom2\", ...],\n"
+    "        \"pain_level\": \"number from 1-10\",\n"
+    "        \"warnings\": [\"warning1\", \"warning2\", ...],\n"
+    "        \"exercises\": [\"exercise1\", \"exercise2\", ...]\n"
+    "    },\n"
+    "    \"actual query response\": [\"your complete response to user in natural language\"]\n"
+    "}\n"
+    "Make sure to use the correct muscle group names as keys. "
+    "The muscle groups are: right trap, right shoulder, right chest, right bicep, right forearm, "
+    "right oblique, left trap, left shoulder, left chest, left bicep, left forearm, left oblique, "
+    "abs, groin, right thigh, left thigh, right calf, left calf.\n"
+    "The pain level should be a number from 1 to 10 as a string, where 1 is minimal pain and 10 is extreme pain. "
+    "The pain_points should describe the specific symptoms (e.g., stiffness, soreness, sharp pain). "
+    "The exercises should be specific to the muscle groups mentioned. "
+    "The warnings should be clear and concise, indicating if the user should seek medical attention.\n"
+    "Please provide a detailed and informative response."
+)
+
+def _format_messages(
+    system_message: str,
+    chat_history: List[Dict[str, str]],
+    user_input: str,
+    body_json: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Build the message list for an API call: system prompt, prior turns, then the current user message.
+    Per-request data (body state and user input) only appears in the last message, keeping the prefix stable.
+    """
+    # Add system message first
+    formatted_messages = [{"role": "system", "content": system_message}]
+    
+    # Add previous conversation history (excluding the latest user message)
+    for message in chat_history:
+        # Skip tool-generated messages when sending to the model
+        if "Stretches for" not in message.get("content", ""):
+            formatted_messages.append({
+                "role": message["role"],
+                "content": message["content"]
+            })
+    
+    # Add current user message, preceded by the body state in JSON mode
+    if body_json:
+        user_input = f"preexisting json file structure: {body_json}\n\nUser Input: {user_input}"
+    formatted_messages.append({"role": "user", "content": user_input})
+    return formatted_messages
+
+# Running totals of prompt tokens and of those served from the provider's prompt cache
+prompt_cache_stats = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+def _log_usage(usage: Any, totals: Optional[Dict[str, int]] = None) -> None:
+    """Record prompt and cached-token counts from an API usage field, adding token counts to totals if given"""
+    if usage is None:
+        return
+    if totals is not None:
+        totals["prompt_tokens"] = totals.get("prompt_tokens", 0) + usage.prompt_tokens
+        totals["completion_tokens"] = totals.get("completion_tokens", 0) + (usage.completion_tokens or 0)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    prompt_cache_stats["calls"] += 1
+    prompt_cache_stats["prompt_tokens"] += usage.prompt_tokens
+    prompt_cache_stats["cached_tokens"] += cached_tokens
+    logger.debug(
+        "Prompt tokens: %d (%d cached); %.0f%% of all prompt tokens cached so far",
+        usage.prompt_tokens, cached_tokens,
+        100 * prompt_cache_stats["cached_tokens"] / max(prompt_cache_stats["prompt_tokens"], 1),
+    )
+
+def _parse_json_response(response_text: str) -> Tuple[str, dict]:
+    """Split a JSON-mode reply into (display_response, per-muscle updates)"""
+    # Try to parse as JSON
+    try:
+        response_json = json.loads(response_text)
+        
+        # Extract and handle "actual query response"
+        actual_response = response_json.pop("actual query response", ["No response found"])
+        if isinstance(actual_response, list):
+            actual_response = "\n".join(actual_response)
+        
+        # Return both display text and the JSON data
+        return actual_response, response_json
+        
+    except json.JSONDecodeError:
+        # If JSON parsing fails, return raw response
+        return response_text, {}
+
+def _normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of a message used for cache keys"""
+    return " ".join(str(text).split()).casefold()
+
+class ResponseCache:
+    """
+    Opt-in cache of generate_chat_analysis results keyed by a hash of the system prompt,
+    the history sent to the model, the body state and the normalized user input.
+    Entries expire after ttl_seconds; the in-memory tier evicts least recently used entries
+    beyond max_entries, and an optional on-disk tier (disk_dir) survives restarts.
+    Tool calls made while producing a response are stored with it and replayed on a hit,
+    so side effects such as send_stretches still reach the chat.
+    """
+    def __init__(self, enabled: bool = False, max_entries: int = 256, ttl_seconds: float = 3600, disk_dir: Optional[str] = None):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """Configure from PHIZZY_RESPONSE_CACHE (set to 1 to enable), _SIZE, _TTL and _DIR"""
+        return cls(
+            enabled=os.getenv("PHIZZY_RESPONSE_CACHE", "0") == "1",
+            max_entries=int(os.getenv("PHIZZY_RESPONSE_CACHE_SIZE", "256")),
+            ttl_seconds=float(os.getenv("PHIZZY_RESPONSE_CACHE_TTL", "3600")),
+            disk_dir=os.getenv("PHIZZY_RESPONSE_CACHE_DIR") or None,
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "saved_ms": self.saved_ms,
+            "entries": len(self._entries),
+        }
+
+    def make_key(self, user_input: str, chat_history: List[Dict[str, str]], body_json: Optional[str]) -> str:
+        normalized_input = _normalize_text(user_input)
+        if body_json:
+            mode, system_message = "json", JSON_SYSTEM_MESSAGE
+        else:
+            mode, system_message = "chat", CHAT_SYSTEM_MESSAGE
+        history = [
+            (message["role"], _normalize_text(message["content"]))
+            for message in _format_messages(system_message, chat_history, normalized_input)[1:-1]
+        ]
+        payload = json.dumps([mode, system_message, history, body_json or "", normalized_input])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the live entry for key from memory or disk, or None"""
+        entry = self._entries.get(key)
+        if entry is None and self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with open(self._disk_path(key), "r") as f:
+                    entry = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                entry = None
+        if entry is None or time.time() - entry["created"] > self.ttl_seconds:
+            self._entries.pop(key, None)
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(
+        self,
+        key: str,
+        result: Union[str, Tuple[str, dict]],
+        tool_calls: List[ChatCompletionMessageToolCall],
+        latency_ms: float,
+    ) -> None:
+        """Store a successful result along with the tool calls that produced its side effects"""
+        display = result[0] if isinstance(result, tuple) else result
+        if display == ERROR_RESPONSE:
+            return
+        entry = {
+            "created": time.time(),
+            "latency_ms": latency_ms,
+            "result": list(result) if isinstance(result, tuple) else result,
+            "tool_calls": [[call.function.name, call.function.arguments] for call in tool_calls],
+        }
+        self._remember(key, entry)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            with open(self._disk_path(key), "w") as f:
+                json.dump(entry, f)
+
+    async def replay(self, key: str) -> Union[str, Tuple[str, dict], None]:
+        """On a hit, re-run the recorded tool calls and return a fresh copy of the cached result"""
+        entry = self.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_ms += entry["latency_ms"]
+        logger.debug("Response cache hit: %.0f%% hit rate, %.0fms saved so far", 100 * self.hit_rate, self.saved_ms)
+
+        if entry["tool_calls"]:
+            await process_tool_calls([
+                ChatCompletionMessageToolCall(
+                    id=f"cached_{i}", type="function", function=Function(name=name, arguments=arguments)
+                )
+                for i, (name, arguments) in enumerate(entry["tool_calls"])
+            ])
+        result = copy.deepcopy(entry["result"])
+        return tuple(result) if isinstance(result, list) else result
+
+response_cache = ResponseCache.from_env()
+
+class RoundTripStats:
+    """
+    Counts chat turns whose first reply was tool calls only (each needed a second completion before
+    tools were handled locally) against turns that still made a follow-up completion.
+    """
+    def __init__(self):
+        self.turns = 0
+        self.tool_only_turns = 0
+        self.followup_turns = 0
+
+    def record(self, tool_only: bool, followups: int) -> None:
+        self.turns += 1
+        self.tool_only_turns += bool(tool_only)
+        self.followup_turns += bool(followups)
+        logger.debug(
+            "Two-round-trip turns: %d/%d before local tool handling, %d/%d now (tool follow-up mode %s)",
+            self.tool_only_turns, self.turns, self.followup_turns, self.turns, TOOL_FOLLOWUP_MODE,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "turns": self.turns,
+            "tool_only_turns": self.tool_only_turns,
+            "followup_turns": self.followup_turns,
+            "followup_mode": TOOL_FOLLOWUP_MODE,
+        }
+
+round_trip_stats = RoundTripStats()
+
+def _tool_result_messages(tool_calls: List[ChatCompletionMessageToolCall], results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The assistant tool-call message and one tool message per locally executed call"""
+    messages: List[Dict[str, Any]] = [{'role': 'assistant', 'content': None, 'tool_calls': tool_calls}]
+    for tool_call, result in zip(tool_calls, results):
+        content = FALLBACK_TOOL_RESULT if result["status"] == "success" else f"Tool failed: {result['message']}"
+        messages.append({'role': 'tool', 'tool_call_id': tool_call.id, 'content': content})
+    return messages
+
+def _attached_reply(tool_calls: List[ChatCompletionMessageToolCall], results: List[Dict[str, Any]]) -> str:
+    """Reply for a tool-only turn built from the tool results, so no follow-up completion is needed"""
+    muscles = [
+        json.loads(tool_call.function.arguments).get("muscle")
+        for tool_call, result in zip(tool_calls, results)
+        if tool_call.function.name == "send_stretches" and result["status"] == "success"
+    ]
+    if not muscles:
+        return NO_CONTENT_RESPONSE
+    return f"Here are some stretches for {', '.join(muscles)}. Is there anything specific you'd like to know more about?"
+
+def _compact_context(
+    user_input: str,
+    chat_history: List[Dict[str, str]],
+    body_json: Optional[str],
+    focus_groups: Optional[List[str]],
+) -> Tuple[List[Dict[str, str]], Optional[str], Dict[str, int]]:
+    """Apply the context token budget and log how many tokens it saved"""
+    history, body_json, stats = build_context(user_input, chat_history, body_json, focus_groups)
+    logger.debug("Context tokens: %d -> %d (budget %d)", stats["tokens_before"], stats["tokens_after"], stats["budget"])
+    return history, body_json, stats
+
 async def generate_chat_analysis(
     user_input: str, 
     chat_history: List[Dict[str, str]] = None,
     body_json: str = None,
+    use_cache: Optional[bool] = None,
+    focus_groups: Optional[List[str]] = None,
 ) -> Union[str, Tuple[str, dict]]:
     """
     Generate an analysis of user's physical health concerns.
@@ -32,115 +433,94 @@ async def generate_chat_analysis(
         user_input: The user's current message
         chat_history: Optional chat history for context
         body_json: Optional JSON string containing current body status
+        use_cache: Serve repeated requests from the response cache (defaults to response_cache.enabled)
+        focus_groups: Muscle groups whose full details must be kept when the body state is compacted
         
     Returns:
         If body_json is provided, returns a tuple with (display_response, parsed_json_response)
         Otherwise, returns just the text response
     """
-    # Use chat history if provided, otherwise initialize empty
     if chat_history is None:
         chat_history = []
-        
-    # Define tools in the correct format for all system prompts
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "send_stretches",
-                "description": "Send specific stretches for a muscle group",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "muscle": {
-                            "type": "string",
-                            "enum": [
-                                "hands", "forearms", "biceps", "front-shoulders", "chest", 
-                                "obliques", "abdominals", "quads", "calves", "triceps", 
-                                "rear-shoulders", "traps", "traps-middle", "lats", 
-                                "lowerback", "hamstrings", "glutes", "calves"
-                            ],
-                            "description": "The specific muscle group to get stretches for"
-                        }
-                    },
-                    "required": ["muscle"]
-                }
-            }
-        }
+    if not (response_cache.enabled if use_cache is None else use_cache):
+        return await _generate_chat_analysis(user_input, chat_history, body_json, [], focus_groups)
+    
+    key = response_cache.make_key(user_input, chat_history, body_json)
+    cached = await response_cache.replay(key)
+    if cached is not None:
+        return cached
+    
+    tool_call_log: List[ChatCompletionMessageToolCall] = []
+    start = time.perf_counter()
+    result = await _generate_chat_analysis(user_input, chat_history, body_json, tool_call_log, focus_groups)
+    response_cache.put(key, result, tool_call_log, (time.perf_counter() - start) * 1000)
+    return result
+
+async def _send_stretches_directly(muscles: List[str], tool_call_log: List[ChatCompletionMessageToolCall]) -> str:
+    """Answer a stretch request by calling send_stretches locally, without a model"""
+    tool_calls = [
+        ChatCompletionMessageToolCall(
+            id=f"direct_{i}", type="function", function=Function(name="send_stretches", arguments=json.dumps({"muscle": muscle}))
+        )
+        for i, muscle in enumerate(muscles)
     ]
+    results = await process_tool_calls(tool_calls)
+    tool_call_log.extend(tool_calls)
+    return _attached_reply(tool_calls, results)
+
+async def _generate_chat_analysis(
+    user_input: str,
+    chat_history: List[Dict[str, str]],
+    body_json: Optional[str],
+    tool_call_log: List[ChatCompletionMessageToolCall],
+    focus_groups: Optional[List[str]] = None,
+) -> Union[str, Tuple[str, dict]]:
+    """Uncached generate_chat_analysis; tool calls that were executed are appended to tool_call_log"""
+    route = model_router.route(user_input)
+    usage: Dict[str, int] = {}
+    start = time.perf_counter()
+    if route.name == "direct":
+        reply = await _send_stretches_directly(route.muscles, tool_call_log)
+        result = (reply, {}) if body_json else reply
+    else:
+        result = await _complete_chat_analysis(user_input, chat_history, body_json, tool_call_log, focus_groups, route.model, usage)
+    model_router.record(route, (time.perf_counter() - start) * 1000, usage)
+    return result
+
+async def _complete_chat_analysis(
+    user_input: str,
+    chat_history: List[Dict[str, str]],
+    body_json: Optional[str],
+    tool_call_log: List[ChatCompletionMessageToolCall],
+    focus_groups: Optional[List[str]],
+    model: str,
+    usage: Dict[str, int],
+) -> Union[str, Tuple[str, dict]]:
+    """Answer a turn with model; token usage of every completion is added to usage"""
+    # Fit history and body state into the context token budget
+    chat_history, body_json, _ = _compact_context(user_input, chat_history, body_json, focus_groups)
+        
+    tools = TOOLS
         
     # Create the appropriate system message based on whether body_json is provided
     if body_json:
         # Create system message with JSON structure instructions
-        system_message = (
-            "You are PhizzyAI, an advanced AI physical therapist. Your role is to analyze user-reported "
-            "pain, discomfort, or physical issues and provide detailed, empathetic, and actionable advice. "
-            "You are highly knowledgeable in anatomy, physical therapy techniques, and rehabilitation exercises. "
-            "When a user describes their symptoms, you will:\n"
-            "1. Identify the potential cause of the issue based on the symptoms described.\n"
-            "2. Suggest specific stretches, exercises, or techniques to alleviate the pain or discomfort.\n"
-            "3. Provide clear warnings if the symptoms described could indicate a serious condition that requires "
-            "immediate medical attention.\n"
-            "4. Always communicate in a professional, empathetic, and easy-to-understand manner.\n\n"
-            f"User Input: {user_input}\n\n"
-            f"preexisting json file structure: {body_json}\n\n"
-            "You have access to the following tools:\n"
-            "- send_stretches: Send specific stretches for a muscle group\n"
-            "  Parameters: muscle (string) - one of: hands, forearms, biceps, front-shoulders, chest, obliques, abdominals, "
-            "quads, calves, triceps, rear-shoulders, traps, traps-middle, lats, lowerback, hamstrings, glutes, calves\n\n"
-            "Your response should include:\n"
-            "- A brief analysis of the symptoms.\n"
-            "- Suggested actions or exercises.\n"
-            "- Any necessary warnings or advice to seek medical attention if applicable.\n"
-            "If you recommend stretches for specific muscles, use the send_stretches tool to provide links.\n\n"
-            "Create a JSON object with the following structure:\n"
-            "{\n"
-            "    \"muscle_group_name\": {\n"
-            "        \"pain_points\": [\"symptom1\", \"symptom2\", ...],\n"
-            "        \"pain_level\": \"number from 1-10\",\n"
-            "        \"warnings\": [\"warning1\", \"warning2\", ...],\n"
-            "        \"exercises\": [\"exercise1\", \"exercise2\", ...]\n"
-            "    },\n"
-            "    \"actual query response\": [\"your complete response to user in natural language\"]\n"
-            "}\n"
-            "Make sure to use the correct muscle group names as keys. "
-            "The muscle groups are: right trap, right shoulder, right chest, right bicep, right forearm, "
-            "right oblique, left trap, left shoulder, left chest, left bicep, left forearm, left oblique, "
-            "abs, groin, right thigh, left thigh, right calf, left calf.\n"
-            "The pain level should be a number from 1 to 10 as a string, where 1 is minimal pain and 10 is extreme pain. "
-            "The pain_points should describe the specific symptoms (e.g., stiffness, soreness, sharp pain). "
-            "The exercises should be specific to the muscle groups mentioned. "
-            "The warnings should be clear and concise, indicating if the user should seek medical attention.\n"
-            "Please provide a detailed and informative response."
-        )
+        system_message = JSON_SYSTEM_MESSAGE
         
         # Use o4-mini for JSON structure responses
         try:
             # Format chat history for API call
-            formatted_messages = []
-            
-            # Add system message first
-            formatted_messages.append({"role": "system", "content": system_message})
-            
-            # Add previous conversation history (excluding the latest user message)
-            for message in chat_history:
-                # Skip tool-generated messages when sending to the model
-                if "Stretches for" not in message.get("content", ""):
-                    formatted_messages.append({
-                        "role": message["role"],
-                        "content": message["content"]
-                    })
-            
-            # Add current user message
-            formatted_messages.append({"role": "user", "content": user_input})
+            formatted_messages = _format_messages(system_message, chat_history, user_input, body_json)
             
             # Make API call with tools included
             response = await client.chat.completions.create(
-                model='gpt-4o',
+                model=model,
                 messages=formatted_messages,
                 tools=tools,
                 tool_choice="auto",
                 response_format={"type": "json_object"},
             )
+            _log_usage(getattr(response, "usage", None), usage)
             
             response_message = response.choices[0].message
             response_text = response_message.content or "{}"
@@ -148,131 +528,272 @@ async def generate_chat_analysis(
             # Process tool calls if they exist
             if hasattr(response_message, 'tool_calls') and response_message.tool_calls:
                 await process_tool_calls(response_message.tool_calls)
+                tool_call_log.extend(response_message.tool_calls)
             
-            # Try to parse as JSON
-            try:
-                response_json = json.loads(response_text)
-                
-                # Extract and handle "actual query response"
-                actual_response = response_json.pop("actual query response", ["No response found"])
-                if isinstance(actual_response, list):
-                    actual_response = "\n".join(actual_response)
-                
-                # Return both display text and the JSON data
-                return actual_response, response_json
-                
-            except json.JSONDecodeError:
-                # If JSON parsing fails, return raw response
-                return response_text, {}
+            return _parse_json_response(response_text)
                 
         except Exception as e:
-            print(f"Error in generate_chat_analysis json mode: {e}")
-            return f"I'm sorry, there was an error processing your request. Please try again.", {}
+            logger.error("Error in generate_chat_analysis json mode: %s", e)
+            return ERROR_RESPONSE, {}
     
     else:
         # Use chat-based approach with tools for regular chat mode
-        system_message = (
-            "You are PhizzyAI, an advanced AI physical therapist. Your role is to analyze user-reported "
-            "pain, discomfort, or physical issues and provide detailed, empathetic, and actionable advice. "
-            "You are highly knowledgeable in anatomy, physical therapy techniques, and rehabilitation exercises. "
-            "When a user describes their symptoms, you will:\n"
-            "1. Identify the potential cause of the issue based on the symptoms described.\n"
-            "2. Suggest specific stretches, exercises, or techniques to alleviate the pain or discomfort.\n"
-            "3. Provide clear warnings if the symptoms described could indicate a serious condition that requires "
-            "immediate medical attention.\n"
-            "4. Always communicate in a professional, empathetic, and easy-to-understand manner.\n\n"
-            "You have access to the following tools:\n"
-            "- send_stretches: Send specific stretches for a muscle group\n"
-            "  Parameters: muscle (string) - one of: hands, forearms, biceps, front-shoulders, chest, obliques, abdominals, "
-            "quads, calves, triceps, rear-shoulders, traps, traps-middle, lats, lowerback, hamstrings, glutes, calves\n\n"
-            "Your response should include:\n"
-            "- A brief analysis of the symptoms.\n"
-            "- Suggested actions or exercises.\n"
-            "- Any necessary warnings or advice to seek medical attention if applicable.\n"
-            "If you recommend stretches for specific muscles, use the send_stretches tool to provide links."
-        )
+        system_message = CHAT_SYSTEM_MESSAGE
         
         try:
             # Format chat history for API call
-            formatted_messages = []
-            
-            # Add system message first
-            formatted_messages.append({"role": "system", "content": system_message})
-            
-            # Add previous conversation history (excluding the latest user message)
-            for message in chat_history:
-                # Skip tool-generated messages when sending to the model
-                if "Stretches for" not in message.get("content", ""):
-                    formatted_messages.append({
-                        "role": message["role"],
-                        "content": message["content"]
-                    })
-            
-            # Add current user message
-            formatted_messages.append({"role": "user", "content": user_input})
+            formatted_messages = _format_messages(system_message, chat_history, user_input)
             
             # Make API call with conversation history
             response = await client.chat.completions.create(
-                model='gpt-4o',
+                model=model,
                 messages=formatted_messages,
                 tools=tools,
                 tool_choice="auto",
             )
-            
-            # Process response for tool calls
+            _log_usage(getattr(response, "usage", None), usage)
             response_message = response.choices[0].message
+            tool_only = bool(response_message.tool_calls) and not response_message.content
             
-            if hasattr(response_message, 'tool_calls') and response_message.tool_calls:
-                await process_tool_calls(response_message.tool_calls)
-            
-            # Return the content directly if available
-            if response_message.content:
-                return response_message.content
-            
-            # If no content but tool calls were made, get a follow-up response
-            if hasattr(response_message, 'tool_calls') and response_message.tool_calls:
-                # Add tool call info
-                formatted_messages.append({
-                    'role': 'assistant',
-                    'content': None,
-                    'tool_calls': response_message.tool_calls
-                })
-                
-                # Add tool call results
-                for tool_call in response_message.tool_calls:
-                    formatted_messages.append({
-                        'role': 'tool',
-                        'tool_call_id': tool_call.id,
-                        'content': "Tools processed successfully. Stretches have been sent to the user."
-                    })
-                
-                fallback_response = await client.chat.completions.create(
-                    model='gpt-4o',
+            # Run tool calls locally; a reply that is tool calls only is finished without
+            # another completion (attach mode) or with a follow-up that sees the tool results
+            followups = 0
+            content = response_message.content
+            while response_message.tool_calls:
+                tool_calls = response_message.tool_calls
+                results = await process_tool_calls(tool_calls)
+                tool_call_log.extend(tool_calls)
+                if content:
+                    break
+                if TOOL_FOLLOWUP_MODE == "attach":
+                    content = _attached_reply(tool_calls, results)
+                    break
+                if followups >= MAX_TOOL_FOLLOWUPS:
+                    break
+                followups += 1
+                formatted_messages.extend(_tool_result_messages(tool_calls, results))
+                # The tool schema stays in every call so the cached prompt prefix is reused
+                response = await client.chat.completions.create(
+                    model=model,
                     messages=formatted_messages,
+                    tools=tools,
+                    tool_choice="auto" if followups < MAX_TOOL_FOLLOWUPS else "none",
                 )
-                
-                return fallback_response.choices[0].message.content
+                _log_usage(getattr(response, "usage", None), usage)
+                response_message = response.choices[0].message
+                content = response_message.content
             
-            # If all else fails
-            return "I've analyzed your input and sent appropriate resources. Is there anything specific you'd like to know more about?"
+            round_trip_stats.record(tool_only, followups)
+            return content or NO_CONTENT_RESPONSE
         
         except Exception as e:
-            print(f"Error in generate_chat_analysis: {e}")
-            return f"I'm sorry, there was an error processing your request. Please try again."
-
-async def process_tool_calls(tool_calls):
-    """Process tool calls from the LLM response"""
-    for tool_call in tool_calls:
-        function_name = tool_call.function.name
-        function_args = json.loads(tool_call.function.arguments)
-        
-        if function_name == "send_stretches":
-            muscle = function_args.get("muscle")
-            if muscle:
-                await mcp_server.send_stretches(muscle)
-    
-    # Wait briefly to ensure tool calls are processed
-    await asyncio.sleep(0.5)
+            logger.error("Error in generate_chat_analysis: %s", e)
+            return ERROR_RESPONSE
+
+def _tool_calls_from_deltas(partial_calls: Dict[int, Dict[str, str]]) -> List[ChatCompletionMessageToolCall]:
+    """Assemble streamed tool-call fragments (keyed by index) into complete tool calls"""
+    return [
+        ChatCompletionMessageToolCall(
+            id=call["id"],
+            type="function",
+            function=Function(name=call["name"], arguments=call["arguments"] or "{}"),
+        )
+        for _, call in sorted(partial_calls.items())
+    ]
+
+class ChatAnalysisStream:
+    """
+    Streaming counterpart of generate_chat_analysis.
+    Iterate it with `async for delta in stream` to receive display text as it arrives; afterwards
+    `result` holds the same value generate_chat_analysis would have returned, and `ttft_ms` /
+    `total_ms` hold the time to first displayed token and the total generation time.
+    In JSON mode only the "actual query response" field is streamed; the per-muscle updates
+    become available in `result` once the JSON object has closed.
+    With the response cache enabled, a hit replays its tool calls and yields the cached text at once.
+    `route` records how model_router handled the turn.
+    """
+    def __init__(
+        self,
+        user_input: str,
+        chat_history: List[Dict[str, str]] = None,
+        body_json: str = None,
+        use_cache: Optional[bool] = None,
+        focus_groups: Optional[List[str]] = None,
+    ):
+        self.user_input = user_input
+        self.chat_history = chat_history or []
+        self.body_json = body_json
+        self.use_cache = response_cache.enabled if use_cache is None else use_cache
+        self.focus_groups = focus_groups
+        self.tool_calls: List[ChatCompletionMessageToolCall] = []
+        self.route: Optional[Route] = None
+        self.usage: Dict[str, int] = {}
+        self.context_stats: Optional[Dict[str, int]] = None
+        self.result: Union[str, Tuple[str, dict], None] = None
+        self.ttft_ms: Optional[float] = None
+        self.total_ms: Optional[float] = None
+        self._start = None
+
+    def _mark_token(self) -> None:
+        if self.ttft_ms is None:
+            self.ttft_ms = (time.perf_counter() - self._start) * 1000
+
+    async def _stream_completion(self, messages, partial_calls, **kwargs) -> AsyncIterator[str]:
+        """Yield raw content deltas of one streamed completion, collecting tool-call fragments"""
+        response = await client.chat.completions.create(
+            model=self.route.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs,
+        )
+        async for chunk in response:
+            # With include_usage the final chunk carries the usage field and no choices
+            _log_usage(getattr(chunk, "usage", None), self.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            for tool_delta in delta.tool_calls or []:
+                call = partial_calls.setdefault(tool_delta.index, {"id": None, "name": "", "arguments": ""})
+                if tool_delta.id:
+                    call["id"] = tool_delta.id
+                if tool_delta.function and tool_delta.function.name:
+                    call["name"] += tool_delta.function.name
+                if tool_delta.function and tool_delta.function.arguments:
+                    call["arguments"] += tool_delta.function.arguments
+            if delta.content:
+                yield delta.content
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        self._start = time.perf_counter()
+        try:
+            if self.use_cache:
+                key = response_cache.make_key(self.user_input, self.chat_history, self.body_json)
+                cached = await response_cache.replay(key)
+                if cached is not None:
+                    self.result = cached
+                    self._mark_token()
+                    yield cached[0] if isinstance(cached, tuple) else cached
+                    return
+
+            self.route = model_router.route(self.user_input)
+            if self.route.name == "direct":
+                reply = await _send_stretches_directly(self.route.muscles, self.tool_calls)
+                self.result = (reply, {}) if self.body_json else reply
+                self._mark_token()
+                yield reply
+            else:
+                history, body_json, self.context_stats = _compact_context(
+                    self.user_input, self.chat_history, self.body_json, self.focus_groups
+                )
+                if body_json:
+                    async for text in self._stream_json_mode(history, body_json):
+                        yield text
+                else:
+                    async for text in self._stream_chat_mode(history):
+                        yield text
+            model_router.record(self.route, (time.perf_counter() - self._start) * 1000, self.usage)
+
+            if self.use_cache:
+                response_cache.put(key, self.result, self.tool_calls, (time.perf_counter() - self._start) * 1000)
+        except Exception as e:
+            logger.error("Error in ChatAnalysisStream: %s", e)
+            self.result = (ERROR_RESPONSE, {}) if self.body_json else ERROR_RESPONSE
+        finally:
+            self.total_ms = (time.perf_counter() - self._start) * 1000
+            ttft = f"{self.ttft_ms:.0f}ms" if self.ttft_ms is not None else "n/a"
+            logger.debug("ChatAnalysisStream: time to first token %s, total %.0fms", ttft, self.total_ms)
+
+    async def _stream_json_mode(self, history: List[Dict[str, str]], body_json: str) -> AsyncIterator[str]:
+        messages = _format_messages(JSON_SYSTEM_MESSAGE, history, self.user_input, body_json)
+        field_streamer = JsonFieldStreamer("actual query response")
+        raw_chunks: List[str] = []
+        partial_calls: Dict[int, Dict[str, str]] = {}
+        async for content in self._stream_completion(
+            messages, partial_calls,
+            tools=TOOLS, tool_choice="auto", response_format={"type": "json_object"},
+        ):
+            raw_chunks.append(content)
+            text = field_streamer.feed(content)
+            if text:
+                self._mark_token()
+                yield text
+
+        if partial_calls:
+            self.tool_calls = _tool_calls_from_deltas(partial_calls)
+            await process_tool_calls(self.tool_calls)
+        self.result = _parse_json_response("".join(raw_chunks) or "{}")
+
+    async def _stream_chat_mode(self, history: List[Dict[str, str]]) -> AsyncIterator[str]:
+        messages = _format_messages(CHAT_SYSTEM_MESSAGE, history, self.user_input)
+        content_chunks: List[str] = []
+        tool_only = None
+        followups = 0
+        tool_choice = "auto"
+        while True:
+            partial_calls: Dict[int, Dict[str, str]] = {}
+            round_content = False
+            async for content in self._stream_completion(messages, partial_calls, tools=TOOLS, tool_choice=tool_choice):
+                round_content = True
+                content_chunks.append(content)
+                self._mark_token()
+                yield content
+
+            tool_calls = _tool_calls_from_deltas(partial_calls)
+            if tool_only is None:
+                tool_only = bool(tool_calls) and not round_content
+            if not tool_calls:
+                break
+            self.tool_calls.extend(tool_calls)
+            results = await process_tool_calls(tool_calls)
+            if round_content:
+                break
+            if TOOL_FOLLOWUP_MODE == "attach":
+                # Answer from the tool results instead of a second completion
+                reply = _attached_reply(tool_calls, results)
+                content_chunks.append(reply)
+                self._mark_token()
+                yield reply
+                break
+            if followups >= MAX_TOOL_FOLLOWUPS:
+                break
+            # Stream a follow-up that sees the tool results
+            followups += 1
+            messages.extend(_tool_result_messages(tool_calls, results))
+            tool_choice = "auto" if followups < MAX_TOOL_FOLLOWUPS else "none"
+
+        round_trip_stats.record(tool_only, followups)
+        self.result = "".join(content_chunks) or NO_CONTENT_RESPONSE
+
+# Seconds a single tool call may run before it is abandoned
+TOOL_TIMEOUT = float(os.getenv("PHIZZY_TOOL_TIMEOUT", "10"))
+# Per-tool overrides of TOOL_TIMEOUT
+TOOL_TIMEOUTS: Dict[str, float] = {}
+
+async def _run_tool_call(tool_call) -> Dict[str, Any]:
+    """Run one tool call through the MCP server's tool registry, isolating its errors"""
+    function_name = tool_call.function.name
+    tool = mcp_server.tools.get(function_name)
+    if tool is None:
+        logger.error("Unknown tool requested: %s", function_name)
+        return {"status": "error", "message": f"Unknown tool: {function_name}"}
+    try:
+        function_args = json.loads(tool_call.function.arguments or "{}")
+        result = await asyncio.wait_for(tool(**function_args), TOOL_TIMEOUTS.get(function_name, TOOL_TIMEOUT))
+        return {"status": "success", "data": result}
+    except asyncio.TimeoutError:
+        logger.error("Tool %s timed out", function_name)
+        return {"status": "error", "message": f"{function_name} timed out"}
+    except Exception as e:
+        logger.error("Error in tool %s: %s", function_name, e)
+        return {"status": "error", "message": str(e)}
+
+async def process_tool_calls(tool_calls) -> List[Dict[str, Any]]:
+    """
+    Process tool calls from the LLM response concurrently.
+    Returns one handle_request-style result per call, in order, once every call has finished.
+    """
+    return await asyncio.gather(*(_run_tool_call(tool_call) for tool_call in tool_calls))
 
 def get_audio_input():
     recognizer = sr.Recognizer()
@@ -0,0 +1,48 @@
+import os
+import threading
+import time
+import uuid
+
+import streamlit as st
+
+from body_store import DEFAULT_USER_ID, SESSION_USER_PREFIX, body_store
+
+# Where a session's user id comes from: "shared" (every session uses the default user, whose state the
+# body.json migration fills), "query" (?user=<id>, only safe behind a proxy that authenticates it, else
+# as "session") or "session" (a throwaway id per browser session; its state is lost on refresh)
+USER_MODE = os.getenv("PHIZZY_USER_MODE", "shared")
+USER_MODES = ("shared", "query", "session")
+# State of throwaway session ids is deleted this long after its last write
+SESSION_TTL_HOURS = float(os.getenv("PHIZZY_SESSION_TTL_HOURS", "24"))
+# Least time between two sweeps for expired session state
+SESSION_EXPIRY_INTERVAL_S = 3600
+
+_last_expiry = 0.0
+_expiry_lock = threading.Lock()
+
+def expire_session_states() -> None:
+    """Delete expired session state, at most once per SESSION_EXPIRY_INTERVAL_S per process"""
+    global _last_expiry
+    now = time.time()
+    with _expiry_lock:
+        if now - _last_expiry < SESSION_EXPIRY_INTERVAL_S:
+            return
+        _last_expiry = now
+    removed = body_store.expire_users(SESSION_USER_PREFIX, now - SESSION_TTL_HOURS * 3600)
+    if removed:
+        print(f"Expired {removed} stale session state entries")
+
+def session_user_id() -> str:
+    """Body-state key for the current Streamlit session, picked once per session as USER_MODE says"""
+    if "user_id" not in st.session_state:
+        if USER_MODE not in USER_MODES:
+            raise ValueError(f"Unknown PHIZZY_USER_MODE: {USER_MODE}; expected one of {', '.join(USER_MODES)}")
+        if USER_MODE == "shared":
+            user_id = DEFAULT_USER_ID
+        elif USER_MODE == "query" and st.query_params.get("user"):
+            user_id = st.query_params["user"]
+        else:
+            user_id = f"{SESSION_USER_PREFIX}{uuid.uuid4().hex}"
+            expire_session_states()
+        st.session_state.user_id = user_id
+    return st.session_state.user_id